@@ -45,9 +45,10 @@
 from __future__ import unicode_literals, absolute_import
 
 import os, sys
+import argparse
 import logging.handlers
 
-from legendastv import g, filetools, subtitles, utils
+from legendastv import g, filetools, hashtools, subtitles, utils, pipeline
 from legendastv.providers import legendastv
 
 
@@ -89,8 +90,40 @@ def setup_logging():
     return log
 
 
-def main(args):
-    for path in args:
+# Videos identified in OpenSubtitles.org per request, at most
+IDENTIFY_BATCH = 200
+
+# Videos planned together, so searches shared by them run only once,
+# and fetched together, so archives shared by them are handled only once
+PLAN_BATCH = 50
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Find, download and extract the best Legendas.TV subtitle "
+            "for each video file. Runs an API demo if no path is given."
+    )
+
+    parser.add_argument('--jobs', '-j', type=int, default=g.options['jobs'],
+                        help="number of videos to search and download "
+                            "subtitles for at the same time. [Default: %(default)s]")
+
+    parser.add_argument('paths', nargs='*', metavar='PATH',
+                        help="video file, HTTP URL of a video, or directory to "
+                            "search for videos, recursively")
+
+    return parser.parse_args(argv)
+
+
+def iter_videos(paths):
+    """ Yield the video files in paths, walking directories lazily.
+        HTTP URLs are yielded as they are
+    """
+    for path in paths:
+        if hashtools.is_url(path):
+            yield path
+            continue
+
         filename = os.path.expanduser(path)
 
         if os.path.isdir(filename):
@@ -98,16 +131,103 @@ def main(args):
                 for video in files:
                     videofile = os.path.join(root, video)
                     if filetools.is_video(videofile):
-                        subtitles.retrieve_subtitle_for_movie(videofile)
+                        yield videofile
 
         elif os.path.isfile(filename):
-            subtitles.retrieve_subtitle_for_movie(filename)
+            yield filename
 
         else:
             log.warn("Path is not a valid directory or file, ignoring: %s",
                      filename)
 
 
+def identify(videos):
+    """ Pipeline stage: identify a batch of videos in OpenSubtitles.org at
+        once. On errors, each video is later identified by itself
+    """
+    try:
+        titles = subtitles.identify_videos(videos)
+    except Exception as e:
+        log.error("Could not identify videos in OpenSubtitles.org: %s", e)
+        titles = {}
+    return [(video, titles.get(video)) for video in videos]
+
+
+def plan(videos_titles):
+    """ Pipeline stage: search titles and subtitles for a batch of videos,
+        each distinct search only once. Videos that failed map to their
+        error, failing only their own job
+    """
+    movies = []
+    for video, titles in videos_titles:
+        try:
+            movies.append(subtitles.prepare_movie(video, titles))
+        except Exception as e:
+            log.debug("Could not prepare '%s'", video, exc_info=True)
+            movies.append(e)
+
+    planned = iter(subtitles.plan_searches(
+        [_ for _ in movies if _ and not isinstance(_, Exception)]))
+
+    result = []
+    for movie, (_, titles) in zip(movies, videos_titles):
+        if isinstance(movie, Exception):
+            result.append(movie)
+        elif not movie:
+            result.append((None, None, titles))
+        else:
+            subs = next(planned)
+            result.append(subs if isinstance(subs, Exception)
+                          else (movie, subs, titles))
+    return result
+
+
+def choose(movie_subs_titles):
+    """ Pipeline stage: choose the best subtitle for a video """
+    movie, subs, titles = movie_subs_titles
+    if movie is None:
+        return None, None
+    return movie, subtitles.find_subtitle(movie, subs, titles)
+
+
+def fetch(movies_subtitles):
+    """ Pipeline stage: download, extract and save the subtitles chosen for
+        a batch of videos, each archive only once
+    """
+    return subtitles.fetch_subtitles(movies_subtitles)
+
+
+def main(args):
+    args = parse_args(args)
+
+    if not args.paths:
+        run_demo()
+        return
+
+    # Identification, searches and downloads are batched, while each video
+    # subtitle is chosen concurrently with others. Results are in input order
+    stages = [pipeline.Stage('identify', identify, batch=IDENTIFY_BATCH),
+              pipeline.Stage('plan', plan, workers=args.jobs, batch=PLAN_BATCH),
+              pipeline.Stage('choose', choose, workers=args.jobs),
+              pipeline.Stage('fetch', fetch, workers=args.jobs, batch=PLAN_BATCH)]
+
+    total = done = 0
+    for video, result, error in pipeline.Pipeline(stages).run(
+                                                    iter_videos(args.paths)):
+        total += 1
+        if isinstance(error, g.LegendasError):
+            # Login failed, website down: no point in trying the others
+            raise error
+        elif error is not None:
+            utils.notify("ERROR processing '%s': %s", video, error, error=True)
+        elif result:
+            done += 1
+        log.info("[%d] %s: %s", total, video,
+                 "OK" if result else "FAILED")
+
+    log.info("Subtitles retrieved for %d of %d videos", done, total)
+
+
 if __name__ == "__main__":
 
     log = setup_logging()
@@ -116,6 +236,8 @@ if __name__ == "__main__":
 
     if g.options['debug']:
         log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
 
     if not (g.options['login'] and g.options['password']):
         log.warn("Login or password are blank. Some features may be disabled.\n\t"
@@ -123,10 +245,7 @@ if __name__ == "__main__":
                  g.globals['config_file'])
 
     try:
-        if len(sys.argv) < 2:
-            run_demo()
-        else:
-            main(sys.argv[1:])
+        main(sys.argv[1:])
     except KeyboardInterrupt:
         pass
     except g.LegendasError as e:
@@ -19,11 +19,12 @@
 #
 # Utilities to manipulate data like strings, lists and dicts
 
-import re
+import heapq
+import operator
 import difflib
 import logging
 
-from . import utils
+from . import utils, normalize
 
 log = logging.getLogger(__name__)
 
@@ -46,11 +47,193 @@ def get_similarity(text1, text2, ignorecase=True):
     return difflib.SequenceMatcher(None, text1, text2).ratio()
 
 
+class NgramIndex(object):
+    """ Inverted index of strings by their character n-grams (trigrams by
+        default), to quickly find the few strings most likely to be similar
+        to a reference before comparing them with the much slower difflib.
+        Each distinct string gets an id, its position in the index
+    """
+    def __init__(self, n=3, ignorecase=True):
+        self.n = n
+        self.ignorecase = ignorecase
+        self._texts = []
+        self._sizes = []
+        self._ids = {}
+        self._postings = {}
+
+    def __len__(self):
+        return len(self._texts)
+
+    def ngrams(self, text):
+        """ Return the set of n-grams of a string, padded by a space at each
+            end so short strings and word boundaries are also represented
+        """
+        if self.ignorecase:
+            text = text.lower()
+        text = " %s " % text
+        return set(text[i:i+self.n] for i in xrange(len(text) - self.n + 1))
+
+    def add(self, text):
+        """ Index a string, if not indexed yet, and return its id """
+        key = text.lower() if self.ignorecase else text
+        id_ = self._ids.get(key)
+        if id_ is not None:
+            return id_
+
+        id_ = self._ids[key] = len(self._texts)
+        grams = self.ngrams(key)
+        self._texts.append(key)
+        self._sizes.append(len(grams))
+        for gram in grams:
+            self._postings.setdefault(gram, []).append(id_)
+        return id_
+
+    def dice(self, reference):
+        """ Return a dict {id: n-gram similarity to reference}, the Dice
+            coefficient of their n-gram sets, for all strings sharing at
+            least one n-gram with reference
+        """
+        grams = self.ngrams(reference)
+        shared = {}
+        for gram in grams:
+            for id_ in self._postings.get(gram, ()):
+                shared[id_] = shared.get(id_, 0) + 1
+        size = len(grams)
+        return dict((id_, 2.0 * count / (size + self._sizes[id_]))
+                    for id_, count in shared.iteritems())
+
+    def candidates(self, reference, top=50):
+        """ Return the ids of the top strings by n-gram similarity to
+            reference, most similar first
+        """
+        dice = self.dice(reference)
+        return heapq.nlargest(top, dice, key=lambda _: (dice[_], -_))
+
+
+# Score lists longer than this are pre-filtered by n-grams, see score_many()
+PREFILTER_TOP = 100
+
+
+def score_many(reference, candidates, ignorecase=True, cutoff=0.0,
+               best_only=False, top=None, matchers=None):
+    """ Compare a reference string against a list of candidate strings in a
+        single pass, and return a dict with keys:
+        'scores' = a list with the similarity ratio of each candidate
+        'index' = the position of the most similar candidate, or None
+        'best' = the most similar candidate itself, or None
+        'similarity' = the similarity ratio of the best candidate
+        Scores are the same as get_similarity(reference, candidate), so
+        each candidate is the sequence difflib analyzes. With all scores
+        requested that costs the same as get_similarity(), except repeated
+        candidates are compared only once. With a cutoff, or best_only,
+        candidates go through the cheap real_quick_ratio() and quick_ratio()
+        upper bounds before the actual ratio() is computed, so candidates
+        that can not reach cutoff, or the best so far, are skipped. Their
+        score is None. Among equally similar candidates, the first one is
+        the best. To score the same candidates against several references,
+        pass the same dict as matchers to each call, so each candidate is
+        analyzed only once. It is not thread-safe. If top and there are more candidates than that, only the
+        top ones by shared trigrams are compared by difflib. The others are
+        not compared, so their score is 0.0, or None if best_only or cutoff,
+        and can not be the best one
+    """
+    if top and len(candidates) > top:
+        return _score_prefiltered(reference, candidates, ignorecase, cutoff,
+                                  best_only, top, matchers)
+
+    if ignorecase:
+        reference = reference.lower()
+
+    matcher = difflib.SequenceMatcher(None)
+    scores = []
+    seen = {}
+    index = None
+    similarity = 0.0
+
+    for i, candidate in enumerate(candidates):
+        if ignorecase:
+            candidate = candidate.lower()
+
+        if candidate in seen:
+            score = seen[candidate]
+        else:
+            limit = max(cutoff, similarity) if best_only else cutoff
+            # Same orientation as get_similarity(), as ratio() is not
+            # symmetric: reference is seq1, candidate is seq2
+            if matchers is None:
+                matcher.set_seqs(reference, candidate)
+            else:
+                matcher = matchers.get(candidate)
+                if matcher is None:
+                    matcher = matchers[candidate] = difflib.SequenceMatcher(
+                                                        None, b=candidate)
+                matcher.set_seq1(reference)
+            if (limit and (matcher.real_quick_ratio() < limit or
+                           matcher.quick_ratio() < limit)):
+                score = None
+            else:
+                score = matcher.ratio()
+                if score < cutoff:
+                    score = None
+            seen[candidate] = score
+
+        scores.append(score)
+        if score is not None and (index is None or score > similarity):
+            index = i
+            similarity = score
+
+    return dict(scores = scores,
+                index = index,
+                best = candidates[index] if index is not None else None,
+                similarity = similarity)
+
+
+def _score_prefiltered(reference, candidates, ignorecase, cutoff, best_only,
+                       top, matchers):
+    index = NgramIndex(ignorecase=ignorecase)
+    ids = [index.add(_) for _ in candidates]
+    chosen = set(index.candidates(reference, top))
+
+    positions = [i for i, id_ in enumerate(ids) if id_ in chosen]
+    result = score_many(reference, [candidates[_] for _ in positions],
+                        ignorecase, cutoff, best_only, matchers=matchers)
+
+    # Trigram similarities are not on the same scale as difflib ratios, so
+    # candidates left out are not scored by them
+    scores = [None if best_only or cutoff else 0.0] * len(candidates)
+    for position, score in zip(positions, result['scores']):
+        scores[position] = score
+    if result['index'] is not None:
+        result['index'] = positions[result['index']]
+    result['scores'] = scores
+    return result
+
+
+def top_k(items, scores, k=None):
+    """ Return items sorted by their scores, greatest first, or just the k
+        greatest if k is given, selected with a heap instead of sorting them
+        all. Items with equal scores keep their original order
+    """
+    if k is None:
+        return [item for _, item in sorted(zip(scores, items),
+                                           key=operator.itemgetter(0),
+                                           reverse=True)]
+    return [items[i] for i in heapq.nlargest(k, xrange(len(items)),
+                                             key=scores.__getitem__)]
+
+
+def iter_ranked(items, scores):
+    """ Lazy version of top_k(): yield items by their scores, greatest first,
+        ordering each one only when it is requested
+    """
+    heap = [(-score, i) for i, score in enumerate(scores)]
+    heapq.heapify(heap)
+    while heap:
+        yield items[heapq.heappop(heap)[1]]
+
+
 def clean_string(text):
-    text = re.sub(r"^\[.+?]"   ,"",text)
-    text = re.sub(r"[][}{)(.,:_-]"," ",text)
-    text = re.sub(r" +"       ," ",text).strip()
-    return text
+    return normalize.clean_string(text)
 
 
 def filter_dict(d, keys=[], whitelist=True):
@@ -66,10 +249,26 @@ def filter_dict(d, keys=[], whitelist=True):
         return d
 
 
-def print_dictlist(dictlist, keys=None, whitelist=True):
-    """ Prints a list, an item per line """
-    return "\n".join([repr(filter_dict(d, keys, whitelist))
-                      for d in dictlist])
+def print_dictlist(dictlist, keys=None, whitelist=True, limit=None):
+    """ Prints a list, an item per line. If limit, only the first limit
+        items are printed, followed by a count of the ones left out
+    """
+    lines = [repr(filter_dict(d, keys, whitelist))
+             for d in (dictlist[:limit] if limit else dictlist)]
+    if limit and len(dictlist) > limit:
+        lines.append("... and %d more" % (len(dictlist) - limit))
+    return "\n".join(lines)
+
+
+# Maximum number of items in debug dumps of lists
+PREVIEW_LIMIT = 50
+
+
+def lazy_dictlist(dictlist, keys=None, whitelist=True, limit=PREVIEW_LIMIT):
+    """ Lazy version of print_dictlist(), capped to limit items by default,
+        to be used as an argument to logging calls and print_debug()
+    """
+    return utils.Lazy(print_dictlist, dictlist, keys, whitelist, limit)
 
 
 def choose_best_string(reference, candidates, ignorecase=True):
@@ -77,24 +276,9 @@ def choose_best_string(reference, candidates, ignorecase=True):
         with the candidate most similar to the reference, its index on the list
         and the similarity ratio (a float in [0, 1] range)
     """
-    if ignorecase:
-        reference_lower  = reference.lower()
-        candidates_lower = [c.lower() for c in candidates]
-        result = difflib.get_close_matches(reference_lower,
-                                           candidates_lower,1, 0)[0]
-
-        index = candidates_lower.index(result)
-        best  = candidates[index]
-        similarity = get_similarity(reference_lower, result, False)
-
-    else:
-        best = difflib.get_close_matches(reference, candidates, 1, 0)[0]
-        index = candidates.index(best)
-        similarity = get_similarity(reference, best, False)
-
-    return dict(best = best,
-                index = index,
-                similarity = similarity)
+    result = score_many(reference, candidates, ignorecase, best_only=True)
+    del result['scores']
+    return result
 
 
 def choose_best_by_key(reference, dictlist, key, ignorecase=True):
@@ -104,16 +288,12 @@ def choose_best_by_key(reference, dictlist, key, ignorecase=True):
         'index' = the position of the chosen dict in dictlist
         'similarity' = the similarity ratio between reference and dict[key]
     """
-    if ignorecase:
-        best = choose_best_string(reference.lower(),
-                                  [d[key].lower() for d in dictlist],
-                                  ignorecase = False)
-    else:
-        best = choose_best_string(reference, [d[key] for d in dictlist], False)
+    best = score_many(reference, [d[key] for d in dictlist], ignorecase,
+                      best_only=True, top=PREFILTER_TOP)
 
     result = dict(best = dictlist[best['index']],
                   similarity = best['similarity'])
-    utils.print_debug("Chosen best for '%s' in '%s': %s" % (reference, key, result))
+    utils.print_debug("Chosen best for '%s' in '%s': %s", reference, key, result)
     return result
 
 
@@ -19,8 +19,10 @@
 # Miscellaneous file-handling functions
 
 import os
+import shutil
 import zipfile
 import logging
+from io import BytesIO
 
 try:
     import rarfile
@@ -285,10 +287,191 @@ def extract_archive(archive, path=None, extlist=[], keep=True, overwrite=False):
             log.error(e)
 
     log.info("%d extracted files in '%s', filtered by %s\n\t%s",
-             len(outputfiles), archive, extlist, dt.print_dictlist(outputfiles))
+             len(outputfiles), archive, extlist, dt.lazy_dictlist(outputfiles))
     return outputfiles
 
 
+# Separator between the name of a nested archive and the names of its members
+NESTED_SEP = "::"
+
+# Nested archives up to this size are read in memory, larger ones are
+# extracted to disk. Also the maximum nesting depth
+NESTED_MAX_SIZE  = 32 * 2**20
+NESTED_MAX_DEPTH = 3
+
+ARCHIVE_EXTS = ('zip', 'rar')
+
+
+def list_archive(archive, extlist=[]):
+    """ List the files of a zip or rar archive, including the ones inside
+        nested archives, without extracting anything
+        - archive: the archive filename (with path)
+        - extlist: list or a comma-separated string of file extensions (excluding the ".")
+        return: a list of member names matching extlist, or all if extlist is
+            empty, suitable for extract_member(). Members of nested archives
+            are named after them, as "nested.zip::member.srt"
+    """
+    if isinstance(extlist, basestring):
+        extlist = extlist.split(",")
+
+    af = ArchiveFile(archive)
+    if not af:
+        log.error("File is not a supported archive format")
+        return
+
+    try:
+        members = _list_archive(af, extlist, os.path.splitext(archive)[0], 1)
+    finally:
+        if _closerar:
+            af.close()
+
+    log.debug("%d files in archive '%s', filtered by %s\n\t%s",
+              len(members), os.path.basename(archive), extlist,
+              dt.lazy_dictlist(members))
+    return members
+
+
+def _list_archive(af, extlist, path, depth):
+    members = []
+    for info in af.infolist():
+        name = info.filename
+        if name.endswith("/") or (hasattr(info, 'isdir') and info.isdir()):
+            continue
+
+        ext = os.path.splitext(name)[1][1:].lower()
+        if not extlist or ext in extlist:
+            members.append(name)
+
+        elif ext in ARCHIVE_EXTS:
+            if depth >= NESTED_MAX_DEPTH:
+                log.warn("Archive nested too deep, ignoring: %s", name)
+                continue
+            nested = _open_nested(af, info, path)
+            if not nested:
+                continue
+            try:
+                members.extend(NESTED_SEP.join((name, _))
+                               for _ in _list_archive(nested, extlist,
+                                                      path, depth + 1))
+            finally:
+                if _closerar:
+                    nested.close()
+    return members
+
+
+def _open_nested(af, info, path):
+    """ Open a nested archive, in memory if small enough or, if not, after
+        extracting it to path, or from there if already extracted.
+        Return None if not a supported archive
+    """
+    if info.file_size <= NESTED_MAX_SIZE:
+        data = BytesIO(af.read(info.filename))
+        # unrar library only handles files on disk
+        if _closerar or zipfile.is_zipfile(data):
+            return ArchiveFile(data)
+
+    filename = os.path.join(path, *_safe_parts([info.filename]))
+    if (os.path.isfile(filename) and
+        os.path.getsize(filename) == info.file_size):
+        log.debug("Reusing nested archive extracted to disk: %s", filename)
+        return ArchiveFile(filename)
+
+    log.debug("Extracting nested archive to disk: %s", info.filename)
+    return ArchiveFile(_extract_file(af, info.filename, path, filename))
+
+
+def extract_member(archive, member, path=None, overwrite=False):
+    """ Extract a single file from a zip or rar archive, streaming it to disk
+        - archive: the archive filename (with path)
+        - member: the file name in archive, as given by list_archive()
+        - path: the extraction folder, by default the archive path without extension
+        - overwrite: if false and file was already extracted, do not extract it again
+        return: the extracted filename (with path)
+    """
+    if path is None:
+        path = os.path.splitext(archive)[0]
+
+    names = member.split(NESTED_SEP)
+    filename = os.path.join(path, *_safe_parts(names))
+    if not overwrite and os.path.isfile(filename):
+        return filename
+
+    af = ArchiveFile(archive)
+    if not af:
+        log.error("File is not a supported archive format")
+        return
+
+    opened = [af]
+    try:
+        for name in names[:-1]:
+            af = _open_nested(af, af.getinfo(name), path)
+            if not af:
+                log.error("Nested file is not a supported archive format: %s",
+                          name)
+                return
+            opened.append(af)
+        _extract_file(af, names[-1], path, filename)
+    finally:
+        if _closerar:
+            for af in opened:
+                af.close()
+
+    log.debug("Extracted '%s' from '%s'", member, archive)
+    return filename
+
+
+def _extract_file(af, name, path, filename=None):
+    """ Stream an archive member to filename, by default its name in path.
+        Return filename
+    """
+    if filename is None:
+        filename = os.path.join(path, *_safe_parts([name]))
+    safemakedirs(os.path.dirname(filename))
+    partial = filename + ".part"
+    source = af.open(name)
+    try:
+        with open(partial, 'wb') as target:
+            shutil.copyfileobj(source, target)
+    finally:
+        source.close()
+    os.rename(partial, filename)
+    return filename
+
+
+def member_basename(member):
+    """ The file name, without path, of an archive member, as unicode """
+    name = _decode_name(member.split(NESTED_SEP)[-1])
+    return name.replace("\\", "/").rsplit("/", 1)[-1]
+
+
+def _decode_name(name):
+    """ Member names not flagged as UTF-8 are plain bytes in zip archives """
+    if isinstance(name, bytes):
+        try:
+            return name.decode('UTF-8')
+        except UnicodeDecodeError:
+            return name.decode('CP850')
+    return name
+
+
+def _safe_parts(names):
+    """ Relative path components, safe for extraction, of a member name, as
+        a list of names of nested archives and their member.
+        Members of nested archives go inside a folder named after them,
+        without extension, so the archive itself can be extracted too
+    """
+    parts = []
+    for i, name in enumerate(names):
+        name = _decode_name(name)
+        if i < len(names) - 1:
+            name = os.path.splitext(name)[0]
+        # replacing chars invalid for the current filesystem encoding
+        name = name.encode(g.filesystem_encoding, 'replace').decode(g.filesystem_encoding)
+        parts.extend(_ for _ in name.replace("\\", "/").split("/")
+                     if _ and _ not in (".", ".."))
+    return parts
+
+
 def ArchiveFile(filename):
     """ Pseudo class (hence the Case) to wrap both rar and zip handling,
         since they both share almost identical API
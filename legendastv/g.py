@@ -65,13 +65,15 @@ globals.update({
 options = {
     'login'         : "",
     'password'      : "",
-    'debug'         : True,
+    'debug'         : False,
     'cache'         : True,
     'similarity'    : 0.7,
+    'confidence'    : 8.5,
     'notifications' : True,
     'language'      : "pb",
     'osdb_username' : "",
     'osdb_password' : "",
+    'jobs'          : 4,
 }
 
 mapping = {
@@ -81,6 +83,36 @@ mapping = {
 class LegendasError(Exception): pass
 
 
+def _add_config_options(filename, section, items):
+    """ Add (option, value) items to section of config file filename, after
+        its last option, keeping the rest of the file, comments included,
+        as it is. Writing the file with ConfigParser would drop comments
+    """
+    with open(filename) as f:
+        lines = f.readlines()
+
+    sectcre = ConfigParser.RawConfigParser.SECTCRE
+    headers = [i for i, line in enumerate(lines) if sectcre.match(line)]
+    start = [i for i in headers
+             if sectcre.match(lines[i]).group('header') == section][0]
+    end = min([i for i in headers if i > start] or [len(lines)])
+
+    # Back up over blank lines and comments, likely about the next section
+    while end > start + 1 and (not lines[end - 1].strip() or
+                               lines[end - 1][0] in b"#;"):
+        end -= 1
+
+    # Lines are read as bytes, keep them so
+    if not lines[end - 1].endswith(b"\n"):
+        lines[end - 1] += b"\n"
+    lines[end:end] = [b"%s = %s\n" % (option.encode('utf-8'),
+                                      unicode(value).encode('utf-8'))
+                      for option, value in items]
+
+    with open(filename, 'w') as f:
+        f.writelines(lines)
+
+
 def read_config():
 
     from . import filetools
@@ -108,6 +140,7 @@ def read_config():
     cp.read(globals['config_file'])
 
     if cp.has_section(section):
+        missing = []
         for option in options:
             if   isinstance(options[option], bool ): get = cp.getboolean
             elif isinstance(options[option], int  ): get = cp.getint
@@ -117,13 +150,24 @@ def read_config():
             try:
                 options[option] = get(section, option)
 
-            except ConfigParser.NoOptionError as e:
-                log.warn("%s in %s", e, globals['config_file'])
+            except ConfigParser.NoOptionError:
+                missing.append(option)
 
             except ValueError as e:
                 log.warn("%s in '%s' option of %s", e, option,
                          globals['config_file'])
 
+        # Options added after the config file was created, like 'confidence'
+        # and 'jobs', are saved to it with their factory settings
+        if missing:
+            try:
+                _add_config_options(globals['config_file'], section,
+                                    [(_, options[_]) for _ in missing])
+                log.info("New options added to config file %s: %s",
+                         globals['config_file'], ", ".join(sorted(missing)))
+            except IOError as e:
+                log.warn("Could not add new options to config file: %s", e)
+
     if cp.has_section(mapping_section):
         for option in cp.items(mapping_section):
             try:
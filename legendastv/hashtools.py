@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2012 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#    This file is part of Legendas.TV Subtitle Downloader
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+#
+# Video file hashing, as used by OpenSubtitles.org to identify videos:
+# file size plus the 64-bit little-endian words of its first and last 64KiB,
+# summed modulo 2**64. As only those 128KiB are needed, files are read
+# positionally, so videos on remote mounts (FUSE, GVFS) are not copied,
+# and videos served over HTTP are read with Range requests
+
+from __future__ import unicode_literals, absolute_import
+
+import os
+import re
+import sys
+import json
+import time
+import array
+import struct
+import sqlite3
+import urllib2
+import httplib
+import threading
+import logging
+from multiprocessing.pool import ThreadPool
+
+from . import g
+
+log = logging.getLogger(__name__)
+
+
+BLOCK_SIZE = 65536
+MASK = 0xFFFFFFFFFFFFFFFF
+
+
+# Block summing, from fastest to slowest available method
+try:
+    import numpy
+
+    def _blocksum(data):
+        return int(numpy.frombuffer(data, dtype='<u8').sum(dtype=numpy.uint64))
+
+except ImportError:
+
+    _typecode = None
+    if sys.byteorder == 'little':
+        for _ in (b'Q', b'L'):
+            try:
+                if array.array(_).itemsize == 8:
+                    _typecode = _
+                    break
+            except ValueError:
+                pass
+
+    if _typecode:
+        def _blocksum(data):
+            words = array.array(_typecode)
+            words.fromstring(data)
+            return sum(words) & MASK
+
+    else:
+        _fmt = b"<%dQ" % (BLOCK_SIZE // 8)  # unsigned long long little endian
+
+        def _blocksum(data):
+            return sum(struct.unpack(_fmt, data)) & MASK
+
+
+# posix_fadvise(), to drop hashed blocks from the page cache, so scanning a
+# large library does not evict everything else. Native in Python 3.3+
+POSIX_FADV_DONTNEED = getattr(os, 'POSIX_FADV_DONTNEED', 4)  # Linux value
+
+if hasattr(os, 'posix_fadvise'):
+    _fadvise = os.posix_fadvise
+else:
+    try:
+        import ctypes
+        import ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc.posix_fadvise.argtypes = (ctypes.c_int, ctypes.c_int64,
+                                        ctypes.c_int64, ctypes.c_int)
+
+        def _fadvise(fd, offset, length, advice):
+            _libc.posix_fadvise(fd, offset, length, advice)
+
+    except (ImportError, OSError, AttributeError, TypeError):
+        def _fadvise(fd, offset, length, advice):  # @UnusedVariable
+            pass
+
+
+def _pread(fd, size, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+def is_url(filename):
+    return bool(re.match(r'https?://', filename, re.IGNORECASE))
+
+
+def videohash(filename, dontneed=True):
+    """ Return the OpenSubtitles.org hash of a video file or HTTP URL, as a
+        16-char hex string. Only its first and last 64KiB are read,
+        positionally. If dontneed, advise the kernel to drop those blocks
+        from page cache. Raise ValueError if file is smaller than 64KiB
+    """
+    if is_url(filename):
+        vhash, size = _videohash_url(filename)
+        _url_sizes[filename] = size  # for videosize(), saving a HEAD request
+        return vhash
+
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size < BLOCK_SIZE:
+            raise ValueError("File '%s' must be at least %d bytes" %
+                             (filename, BLOCK_SIZE))
+
+        head = _pread(fd, BLOCK_SIZE, 0)
+        tail = _pread(fd, BLOCK_SIZE, size - BLOCK_SIZE)
+        if len(head) != BLOCK_SIZE or len(tail) != BLOCK_SIZE:
+            raise IOError("Short read in '%s'" % filename)
+
+        if dontneed:
+            _fadvise(fd, 0, BLOCK_SIZE, POSIX_FADV_DONTNEED)
+            _fadvise(fd, size - BLOCK_SIZE, BLOCK_SIZE, POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+    return b"%016x" % ((size + _blocksum(head) + _blocksum(tail)) & MASK)
+
+
+# Shared keep-alive connections for hashing URLs
+_opener = None
+_opener_lock = threading.Lock()
+
+# Sizes of hashed URLs, as reported by their Range responses
+_url_sizes = {}
+
+URL_TIMEOUT = 30
+
+
+def _urlopen(url, method=None, **headers):
+    global _opener
+    with _opener_lock:
+        if _opener is None:
+            from . import httptools
+            _opener = httptools.build_opener(httptools.ConnectionPool())
+
+    req = urllib2.Request(url, headers=headers)
+    if method:
+        req.get_method = lambda: method
+    try:
+        return _opener.open(req, timeout=URL_TIMEOUT)
+    except (urllib2.URLError, httplib.HTTPException) as e:
+        raise IOError("Could not read '%s': %s" % (url, e))
+
+
+def _read_range(url, start, end):
+    """ Read bytes start-end (inclusive) of url with an HTTP Range request.
+        Return a 2-tuple (data, total size of url)
+    """
+    response = _urlopen(url, Range="bytes=%d-%d" % (start, end),
+                        **{'Accept-Encoding': 'identity'})
+    try:
+        # Never read a full response, the whole video, if Range is ignored
+        match = re.match(r'bytes\s+(\d+)-\d+/(\d+)',
+                         response.info().getheader('content-range', ""))
+        if response.code != 206 or not match or int(match.group(1)) != start:
+            raise IOError("Server for '%s' does not support ranged reads" %
+                          url)
+        return response.read(), int(match.group(2))
+    finally:
+        response.close()
+
+
+def _videohash_url(url):
+    """ Return a 2-tuple (hash, size) of a video URL """
+    head, size = _read_range(url, 0, BLOCK_SIZE - 1)
+    if size < BLOCK_SIZE:
+        raise ValueError("File '%s' must be at least %d bytes" %
+                         (url, BLOCK_SIZE))
+    tail, _ = _read_range(url, size - BLOCK_SIZE, size - 1)
+    if len(head) != BLOCK_SIZE or len(tail) != BLOCK_SIZE:
+        raise IOError("Short read in '%s'" % url)
+
+    return (b"%016x" % ((size + _blocksum(head) + _blocksum(tail)) & MASK),
+            size)
+
+
+def videosize(filename):
+    """ Size in bytes of a video file or HTTP URL. The size of URLs already
+        hashed is known, others are requested with HEAD
+    """
+    if not is_url(filename):
+        return os.path.getsize(filename)
+
+    if filename in _url_sizes:
+        return _url_sizes[filename]
+
+    response = _urlopen(filename, 'HEAD', **{'Accept-Encoding': 'identity'})
+    try:
+        return int(response.info().getheader('content-length'))
+    except (TypeError, ValueError):
+        raise IOError("Could not get size of '%s'" % filename)
+    finally:
+        response.close()
+
+
+def videohash_many(filenames, workers=4, dontneed=True, cache=None):
+    """ Hash several video files in parallel, using a pool of workers threads.
+        If a HashCache is given, unchanged files already hashed are not read.
+        URLs are never cached.
+        Return a dict {filename: hash}. Files that could not be hashed map to
+        the exception raised
+    """
+    def safehash(filename):
+        try:
+            if cache is None or is_url(filename):
+                return filename, videohash(filename, dontneed)
+
+            entry = cache.lookup(filename)
+            if not entry['hash']:
+                entry['hash'] = videohash(filename, dontneed)
+                cache.store(entry)
+            return filename, entry['hash']
+
+        except (EnvironmentError, ValueError) as e:
+            return filename, e
+
+    filenames = list(filenames)
+    if workers <= 1 or len(filenames) <= 1:
+        return dict(safehash(_) for _ in filenames)
+
+    pool = ThreadPool(min(workers, len(filenames)))
+    try:
+        return dict(pool.imap_unordered(safehash, filenames))
+    finally:
+        pool.close()
+
+
+class HashCache(object):
+    """ Persistent SQLite cache of video hashes and their identification info,
+        keyed on file device, inode, size and modification time, so unchanged
+        files are never read again, and hardlinked duplicates share an entry.
+        For each file it stores its 'hash', the last 'info' retrieved for it
+        (any JSON-serializable data) and when it was 'checked'
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._local = threading.local()
+        self._db().execute("""CREATE TABLE IF NOT EXISTS videos (
+                                dev     INTEGER,
+                                ino     INTEGER,
+                                size    INTEGER,
+                                mtime   INTEGER,
+                                hash    TEXT,
+                                info    TEXT,
+                                checked REAL,
+                                PRIMARY KEY (dev, ino, size, mtime))""")
+
+    def _db(self):
+        # sqlite3 connections can not be shared among threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            self._local.db = db
+        return db
+
+    def lookup(self, filename):
+        """ Return the cache entry of a file as a dict with keys 'key',
+            'hash', 'info' and 'checked', the latter 3 being None if not
+            cached yet. Raise OSError if file can not be stat'ed
+        """
+        st = os.stat(filename)
+        key = (st.st_dev, st.st_ino, st.st_size,
+               getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 10**9))
+        row = self._db().execute("SELECT hash, info, checked FROM videos"
+                                 " WHERE dev = ? AND ino = ? AND size = ?"
+                                 " AND mtime = ?", key).fetchone()
+        entry = dict(key=key, hash=None, info=None, checked=None)
+        if row is not None:
+            entry.update(hash=row[0], checked=row[2],
+                         info=json.loads(row[1]) if row[1] else None)
+            if entry['hash']:
+                entry['hash'] = entry['hash'].encode('ascii')
+        return entry
+
+    def store(self, entry):
+        self._db().execute("INSERT OR REPLACE INTO videos"
+                           " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           entry['key'] + (entry['hash'],
+                                           json.dumps(entry['info'])
+                                           if entry['info'] is not None
+                                           else None,
+                                           entry['checked']))
+
+    def store_info(self, entry, info):
+        """ Save the identification info of a file, timestamped now """
+        entry.update(info=info, checked=time.time())
+        self.store(entry)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """ Return the shared HashCache in cache dir, or None if 'cache' option
+        is disabled
+    """
+    global _cache
+    if not g.options['cache']:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            from . import filetools
+            filetools.safemakedirs(g.globals['cache_dir'])
+            _cache = HashCache(os.path.join(g.globals['cache_dir'],
+                                            "videos.sqlite"))
+    return _cache
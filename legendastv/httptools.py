@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2012 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#    This file is part of Legendas.TV Subtitle Downloader
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+#
+# HTTP helpers: keep-alive connection pooling, gzip content decoding and
+# persistent response cache
+
+from __future__ import unicode_literals, absolute_import
+
+import os
+import zlib
+import time
+import socket
+import urllib
+import urllib2
+import httplib
+import hashlib
+import sqlite3
+import tempfile
+import mimetools
+import threading
+import multiprocessing
+import logging
+from multiprocessing.pool import ThreadPool
+from cStringIO import StringIO
+
+log = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Stale cache entries are kept this long for revalidation, then pruned
+CACHE_PRUNE_AGE = 60*60*24*30  # 30 days
+
+
+class ConnectionPool(object):
+    """ A thread-safe pool of idle, keep-alive HTTP connections per host.
+        At most maxsize idle connections are kept for each host, any extra
+        connection released to the pool is simply closed.
+        stats is a dict of counters: requests, connections (newly created),
+        reused, discarded (closed instead of pooled) and gzip (responses)
+    """
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.stats = dict(requests=0, connections=0, reused=0,
+                          discarded=0, gzip=0)
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, conn_class, host, timeout):
+        """ Return a 2-tuple (connection, reused) for host, either an idle
+            one from the pool or a brand new one
+        """
+        key = (conn_class, host)
+        with self._lock:
+            self.stats['requests'] += 1
+            idle = self._idle.get(key)
+            if idle:
+                self.stats['reused'] += 1
+                return idle.pop(), True
+            self.stats['connections'] += 1
+        return conn_class(host, timeout=timeout), False
+
+    def release(self, conn_class, host, conn):
+        """ Return a connection to the pool, closing it if pool is full """
+        key = (conn_class, host)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+            self.stats['discarded'] += 1
+        conn.close()
+
+    def count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    def size(self):
+        """ Number of idle connections currently in the pool """
+        with self._lock:
+            return sum(len(_) for _ in self._idle.itervalues())
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.itervalues():
+            for conn in conns:
+                conn.close()
+
+
+class PooledResponse(object):
+    """ File-like wrapper around an httplib.HTTPResponse that decodes gzip
+        content on the fly, in CHUNK_SIZE steps, and hands the connection
+        back to its pool as soon as the response body is fully read.
+        Closing it before that discards the connection, as it can not be
+        safely reused.
+    """
+    def __init__(self, response, release=None, gzip=False):
+        self._response = response
+        self._release  = release
+        self._decoder  = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzip else None
+        self._buffer   = b""
+        self._eof      = False
+
+    def _fill(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self._response.read(CHUNK_SIZE)
+            if not data:
+                self._eof = True
+                if self._decoder:
+                    self._buffer += self._decoder.flush()
+                self._done()
+                break
+            if self._decoder:
+                data = self._decoder.decompress(data)
+            self._buffer += data
+
+    def _done(self):
+        release, self._release = self._release, None
+        if release:
+            release(not self._response.will_close)
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while b"\n" not in self._buffer and not self._eof:
+            self._fill(len(self._buffer) + CHUNK_SIZE)
+        end = self._buffer.find(b"\n") + 1 or len(self._buffer)
+        if size is not None and 0 <= size < end:
+            end = size
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+    def readlines(self, sizehint=0):  # @UnusedVariable
+        return list(iter(self.readline, b""))
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def close(self):
+        if self._release:
+            release, self._release = self._release, None
+            release(False)
+        self._response.close()
+
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+    """ urllib2 handler that reuses connections from a ConnectionPool and
+        negotiates gzip content encoding. Drop-in replacement for the
+        default HTTPHandler in urllib2.build_opener()
+    """
+    def __init__(self, pool=None, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool if pool is not None else ConnectionPool()
+
+    def http_open(self, req):
+        return self._keepalive_open(httplib.HTTPConnection, req)
+
+    def _keepalive_open(self, conn_class, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict((k.title(), v) for k, v in req.headers.items())
+        headers.update((k.title(), v) for k, v in req.unredirected_hdrs.items())
+        headers.setdefault('Accept-Encoding', 'gzip')
+        headers['Connection'] = 'keep-alive'
+
+        # A pooled connection may have been dropped by the server while idle,
+        # so if it fails retry once with a fresh one
+        while True:
+            conn, reused = self.pool.acquire(conn_class, host, req.timeout)
+            conn.set_debuglevel(self._debuglevel)
+            try:
+                conn.request(req.get_method(), req.get_selector(),
+                             req.data, headers)
+                response = conn.getresponse()
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                if reused:
+                    log.debug("Stale connection to %s, retrying: %r", host, e)
+                    continue
+                raise urllib2.URLError(e)
+            break
+
+        def release(reusable):
+            if reusable:
+                self.pool.release(conn_class, host, conn)
+            else:
+                conn.close()
+
+        gzip = response.getheader('content-encoding', '').lower() == 'gzip'
+        if gzip:
+            self.pool.count('gzip')
+            # Length and encoding no longer apply to the decoded content
+            del response.msg['content-encoding']
+            del response.msg['content-length']
+
+        fp = PooledResponse(response, release, gzip)
+        resp = urllib.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg  = response.reason
+        return resp
+
+
+if hasattr(httplib, 'HTTPSConnection'):
+    class KeepAliveHTTPSHandler(KeepAliveHandler, urllib2.HTTPSHandler):
+        """ HTTPS counterpart of KeepAliveHandler, sharing the same pool """
+        def https_open(self, req):
+            return self._keepalive_open(httplib.HTTPSConnection, req)
+
+
+class HttpCache(object):
+    """ Persistent on-disk cache for HTTP GET responses.
+        Each body is saved as a file named after the SHA-1 of its URL, and an
+        SQLite index maps that same key to the final (redirected) URL, the
+        response headers, the expiration time and the validators (ETag and
+        Last-Modified) used to revalidate stale entries. So a lookup is a
+        single primary key query, regardless of the cache size. Entries
+        stale for more than prune_age seconds are removed on creation.
+        stats is a dict of counters: hits, misses, stores, revalidated and
+        pruned
+    """
+    def __init__(self, path, prune_age=CACHE_PRUNE_AGE):
+        self.path = path
+        self.stats = dict(hits=0, misses=0, stores=0, revalidated=0, pruned=0)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        from . import filetools
+        filetools.safemakedirs(self.path)
+        self._db().execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key      TEXT PRIMARY KEY,
+                                url      TEXT,
+                                headers  TEXT,
+                                expires  REAL,
+                                etag     TEXT,
+                                modified TEXT)""")
+        self.prune(prune_age)
+
+    def _db(self):
+        # sqlite3 connections can not be shared among threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'),
+                                 timeout=30, isolation_level=None)
+            self._local.db = db
+        return db
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    def _key(self, url):
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return hashlib.sha1(url).hexdigest()
+
+    def _bodyfile(self, key):
+        return os.path.join(self.path, key)
+
+    def lookup(self, url):
+        """ Return the index entry for url, fresh or stale, as a dict with
+            'key', 'url', 'headers', 'expires', 'etag' and 'modified' keys,
+            or None if url is not cached
+        """
+        key = self._key(url)
+        row = self._db().execute("SELECT url, headers, expires, etag, modified"
+                                 " FROM responses WHERE key = ?",
+                                 (key,)).fetchone()
+        if row is None or not os.path.isfile(self._bodyfile(key)):
+            self._count('misses')
+            return None
+        return dict(zip(('url', 'headers', 'expires', 'etag', 'modified'), row),
+                    key=key)
+
+    def open(self, entry):
+        """ Return a urllib2-like response for a cached entry """
+        self._count('hits')
+        resp = urllib.addinfourl(open(self._bodyfile(entry['key']), 'rb'),
+                                 mimetools.Message(StringIO(
+                                     entry['headers'].encode('latin-1'))),
+                                 entry['url'])
+        resp.code = 200
+        resp.msg  = "OK"
+        return resp
+
+    def store(self, url, response, ttl):
+        """ Save a response body and its headers in the cache for ttl seconds,
+            and return a new response reading from the cached copy
+        """
+        key = self._key(url)
+        # Each writer gets its own temporary file, as concurrent requests
+        # for the same url may store it at the same time
+        fd, tmpname = tempfile.mkstemp(prefix=key, suffix=".part",
+                                       dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    f.write(chunk)
+            os.rename(tmpname, self._bodyfile(key))
+        except BaseException:
+            os.remove(tmpname)
+            raise
+        finally:
+            response.close()
+
+        headers = response.info()
+        entry = dict(key      = key,
+                     url      = response.geturl(),
+                     headers  = "".join(headers.headers).decode('latin-1'),
+                     expires  = time.time() + ttl,
+                     etag     = headers.getheader('etag'),
+                     modified = headers.getheader('last-modified'))
+        self._db().execute("INSERT OR REPLACE INTO responses"
+                           " VALUES (:key, :url, :headers, :expires,"
+                           "         :etag, :modified)", entry)
+        self._count('stores')
+        return self.open(entry)
+
+    def refresh(self, entry, ttl, headers=None):
+        """ Mark a revalidated entry (HTTP 304) as fresh for another ttl
+            seconds, updating its validators if new ones were sent.
+            Return a response reading from the cached copy
+        """
+        if headers is not None:
+            entry['etag']     = headers.getheader('etag', entry['etag'])
+            entry['modified'] = headers.getheader('last-modified',
+                                                  entry['modified'])
+        entry['expires'] = time.time() + ttl
+        self._db().execute("UPDATE responses SET expires = :expires,"
+                           " etag = :etag, modified = :modified"
+                           " WHERE key = :key", entry)
+        self._count('revalidated')
+        return self.open(entry)
+
+    def validators(self, entry):
+        """ Return a dict of conditional request headers for a stale entry """
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['modified']:
+            headers['If-Modified-Since'] = entry['modified']
+        return headers
+
+    def prune(self, age=0):
+        """ Remove entries stale for more than age seconds, and their bodies
+        """
+        before = time.time() - age
+        keys = [_[0] for _ in self._db().execute(
+                    "SELECT key FROM responses WHERE expires < ?", (before,))]
+        for key in keys:
+            try:
+                os.remove(self._bodyfile(key))
+            except OSError:
+                pass
+        self._db().execute("DELETE FROM responses WHERE expires < ?", (before,))
+        with self._lock:
+            self.stats['pruned'] += len(keys)
+
+    def clear(self):
+        for key, in self._db().execute("SELECT key FROM responses"):
+            try:
+                os.remove(self._bodyfile(key))
+            except OSError:
+                pass
+        self._db().execute("DELETE FROM responses")
+
+
+class AssetFetcher(object):
+    """ Fetch small static files, like images, to a local dir in background,
+        using a small pool of worker threads created on first use.
+        download is a callable(url, savedir) returning the saved filename.
+        Each url is requested at most once per instance, and never if the
+        file already exists. Failed fetches are forgotten, so a later
+        fetch of the same url tries again.
+    """
+    def __init__(self, download, workers=2):
+        self.workers = workers
+        self._download = download
+        self._pool = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def path(self, url, savedir):
+        """ Local filename of url in savedir, fetched or not """
+        return os.path.join(savedir, os.path.basename(url))
+
+    def fetch(self, url, savedir):
+        """ Schedule url to be saved in savedir and return immediately.
+            Return an AsyncResult whose get() returns the local filename
+        """
+        with self._lock:
+            result = self._pending.get(url)
+            if result is None:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.workers)
+                result = self._pool.apply_async(self._fetch, (url, savedir))
+                self._pending[url] = result
+        return result
+
+    def get(self, url, savedir, timeout=None):
+        """ Fetch url and wait up to timeout seconds for it.
+            Return its local filename, or None on errors or timeout
+        """
+        filename = self.path(url, savedir)
+        if os.path.exists(filename):
+            return filename
+        try:
+            return self.fetch(url, savedir).get(timeout)
+        except multiprocessing.TimeoutError:
+            log.warn("Timeout fetching %s", url)
+        except (urllib2.URLError, httplib.HTTPException, EnvironmentError) as e:
+            log.error("%s\t%s", url, e)
+
+    def _fetch(self, url, savedir):
+        filename = self.path(url, savedir)
+        if os.path.exists(filename):
+            return filename
+        try:
+            return self._download(url, savedir)
+        except Exception:
+            # Do not replay a possibly transient error to later callers
+            with self._lock:
+                self._pending.pop(url, None)
+            raise
+
+
+def build_opener(pool, *handlers):
+    """ Like urllib2.build_opener(), with keep-alive handlers using pool """
+    handlers = (KeepAliveHandler(pool),) + handlers
+    if hasattr(httplib, 'HTTPSConnection'):
+        handlers += (KeepAliveHTTPSHandler(pool),)
+    return urllib2.build_opener(*handlers)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2012 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#    This file is part of Legendas.TV Subtitle Downloader
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+#
+# Text normalization of titles, releases and filenames for matching.
+# Regexes are compiled once, and results of the functions called over and
+# over on the same strings are memoized
+
+from __future__ import unicode_literals, absolute_import
+
+import re
+import functools
+
+
+class LRUCache(object):
+    """ A bounded memo for a single-argument function, keeping roughly the
+        maxsize most recently used results. It uses two generations of
+        plain dicts instead of a strict LRU list, which would cost more than
+        most memoized calls: results live in the current generation, and
+        when it is full it becomes the old one, and the previous old one is
+        discarded. Old results used again move to the current generation.
+        Results are keyed on the argument type too, so str and unicode
+        arguments that compare equal do not share results.
+        Thread-safe, as single dict operations are atomic
+    """
+    def __init__(self, func, maxsize=1024):
+        self.func = func
+        self.maxsize = maxsize
+        self._current = {}
+        self._old = {}
+        functools.update_wrapper(self, func)
+
+    def __call__(self, arg):
+        key = (type(arg), arg)
+        try:
+            return self._current[key]
+        except KeyError:
+            pass
+
+        try:
+            result = self._old[key]
+        except KeyError:
+            result = self.func(arg)
+
+        if len(self._current) >= self.maxsize // 2:
+            self._old, self._current = self._current, {}
+        self._current[key] = result
+        return result
+
+    def __len__(self):
+        return len(self._current) + len(self._old)
+
+    def clear(self):
+        self._current, self._old = {}, {}
+
+
+def memoize(maxsize=1024):
+    """ Decorator to memoize a single-argument function in an LRUCache """
+    return lambda func: LRUCache(func, maxsize)
+
+
+_re_prefix = re.compile(r"^\[.+?]")
+_re_token  = re.compile(r"[^][}{)(.,:_ -]+")  # all but separators
+_re_year   = re.compile(r"(?<!\d)(?:19|20)\d{2}(?!\d)")
+
+# Common release "tags", removed from titles, in this order of precedence
+TAGS = ['1080p', '720p', '480p', 'hdtv', 'h264', 'x264', 'h65', 'dts', 'aac',
+        'ac3', 'bluray', 'bdrip', 'brrip', 'dvd', 'dvdrip', 'xvid', 'mp4',
+        'itunes', 'web dl', 'blu ray']
+_re_tags   = [re.compile(_, re.IGNORECASE) for _ in TAGS]
+_re_spaces = re.compile(r" +")
+
+
+@memoize(4096)
+def clean_string(text):
+    """ Remove a leading [tag], turn brackets and punctuation into spaces
+        and collapse consecutive spaces
+    """
+    if text.startswith(b"["):
+        text = _re_prefix.sub(b"", text, 1)
+    tokens = _re_token.findall(text)
+    if not tokens:
+        return text[:0]
+    # joined by a byte string, so str gives str and unicode gives unicode
+    return b" ".join(tokens).strip()
+
+
+def find_years(text):
+    """ Return a list of all years, 19xx or 20xx, found in text """
+    return _re_year.findall(text)
+
+
+@memoize(1024)
+def remove_tags(text):
+    """ Remove all common release tags from text and collapse spaces.
+        Tags are removed one at a time, in order, as removing one may
+        join the text around it into another, like "hd720ptv" into "hdtv"
+    """
+    for regex in _re_tags:
+        text = regex.sub(b"", text)
+    return _re_spaces.sub(b" ", text).strip()
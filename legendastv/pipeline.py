@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+#
+#    Copyright (C) 2012 Rodrigo Silva (MestreLion) <linux@rodrigosilva.com>
+#    This file is part of Legendas.TV Subtitle Downloader
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+#
+# Concurrent staged pipeline, to process many files with each stage running
+# in its own pool of threads, connected by bounded queues
+
+from __future__ import unicode_literals, absolute_import
+
+import Queue
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+
+_STOP = object()  # end of stream marker
+
+
+class Stage(object):
+    """ A pipeline step: func is called with the value produced by the
+        previous stage, or the input item for the first one, and returns the
+        value for the next stage. Its workers threads run concurrently.
+        If batch, func is instead called with a list of up to batch values,
+        as many as are already queued, and returns a list of results. An
+        exception instance as a result fails only its item, with that error
+    """
+    def __init__(self, name, func, workers=1, batch=0):
+        self.name    = name
+        self.func    = func
+        self.workers = max(workers, 1)
+        self.batch   = batch
+
+
+class Job(object):
+    __slots__ = ('seq', 'item', 'value', 'error')
+
+    def __init__(self, seq, item):
+        self.seq   = seq
+        self.item  = item
+        self.value = item
+        self.error = None
+
+
+class Pipeline(object):
+    """ Run items through a sequence of Stages, concurrently.
+        Stages are connected by queues of at most queuesize items, or
+        their batch size, and at most window items are in flight, read
+        from input but not yet returned, so memory usage is bounded
+        regardless of the number of items, as long as they are given by
+        an iterator.
+        Items failing in a stage skip the remaining ones.
+    """
+    def __init__(self, stages, queuesize=None, window=None):
+        self.stages = list(stages)
+        self.queuesize = queuesize or 2 * max(_.workers for _ in self.stages)
+        self.window = window or max(self.queuesize * (len(self.stages) + 1),
+                                    2 * max(_.batch for _ in self.stages))
+
+    def run(self, items):
+        """ Process items, and yield a 3-tuple (item, result, error) for each
+            one, in the same order as items. error is the exception raised
+            by a stage, if any, and result is the value of the last stage
+        """
+        # Batch stages may queue a whole batch
+        queues = [Queue.Queue(max(self.queuesize, _.batch)) for _ in self.stages]
+        queues.append(Queue.Queue())  # output, already bounded by window
+        window = threading.Semaphore(self.window)
+
+        self._start(target=self._feed, args=(items, queues[0], window))
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for _ in xrange(stage.workers):
+                self._start(target=self._work,
+                            args=(i, stage, queues, remaining, lock))
+
+        output = queues[-1]
+        pending = {}
+        seq = 0
+        while True:
+            # Poll, so the main thread remains responsive to Ctrl+C
+            try:
+                job = output.get(timeout=0.5)
+            except Queue.Empty:
+                continue
+            if job is _STOP:
+                break
+
+            pending[job.seq] = job
+            while seq in pending:
+                job = pending.pop(seq)
+                window.release()
+                seq += 1
+                yield job.item, job.value if job.error is None else None, job.error
+
+    def _start(self, **kwargs):
+        thread = threading.Thread(**kwargs)
+        thread.daemon = True
+        thread.start()
+
+    def _feed(self, items, queue, window):
+        try:
+            for seq, item in enumerate(items):
+                window.acquire()
+                queue.put(Job(seq, item))
+        except Exception as e:
+            log.error("Error reading pipeline input: %s", e)
+        for _ in xrange(self.stages[0].workers):
+            queue.put(_STOP)
+
+    def _work(self, i, stage, queues, remaining, lock):
+        inqueue, outqueue = queues[i], queues[i+1]
+        stop = False
+        while not stop:
+            jobs = [inqueue.get()]
+            if jobs[0] is _STOP:
+                break
+
+            # Take whatever else is already queued, up to batch
+            while len(jobs) < stage.batch:
+                try:
+                    job = inqueue.get_nowait()
+                except Queue.Empty:
+                    break
+                if job is _STOP:
+                    stop = True
+                    break
+                jobs.append(job)
+
+            self._process(stage, [_ for _ in jobs if _.error is None])
+            for job in jobs:
+                outqueue.put(job)
+
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        if i + 1 < len(self.stages):
+            for _ in xrange(self.stages[i+1].workers):
+                outqueue.put(_STOP)
+        else:
+            outqueue.put(_STOP)
+
+    def _process(self, stage, jobs):
+        if not jobs:
+            return
+        try:
+            if stage.batch:
+                for job, value in zip(jobs, stage.func([_.value for _ in jobs])):
+                    if isinstance(value, Exception):
+                        log.debug("Stage '%s' failed for %r: %r", stage.name,
+                                  job.item, value)
+                        job.error = value
+                    else:
+                        job.value = value
+            else:
+                for job in jobs:
+                    try:
+                        job.value = stage.func(job.value)
+                    except Exception as e:
+                        log.debug("Stage '%s' failed for %r", stage.name,
+                                  job.item, exc_info=True)
+                        job.error = e
+        except Exception as e:
+            log.debug("Stage '%s' failed for a batch of %d", stage.name,
+                      len(jobs), exc_info=True)
+            for job in jobs:
+                job.error = e
+
+
+class KeyedLock(object):
+    """ A lock per key, created on demand and discarded when released by
+        all its users, so threads working on the same resource, like a
+        file, are serialized while others proceed.
+        Usage: with keyedlock(key): ...
+    """
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, key):
+        return _KeyedLockContext(self, key)
+
+    def acquire(self, key):
+        with self._lock:
+            lock, users = self._locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._locks[key] = (lock, users + 1)
+        lock.acquire()
+
+    def release(self, key):
+        with self._lock:
+            lock, users = self._locks[key]
+            if users > 1:
+                self._locks[key] = (lock, users - 1)
+            else:
+                del self._locks[key]
+        lock.release()
+
+
+class _KeyedLockContext(object):
+    def __init__(self, keyedlock, key):
+        self.keyedlock = keyedlock
+        self.key = key
+
+    def __enter__(self):
+        self.keyedlock.acquire(self.key)
+
+    def __exit__(self, *args):  # @UnusedVariable
+        self.keyedlock.release(self.key)
+
+
+class SingleFlight(object):
+    """ Memoize func(*key), so each distinct call is made only once, even
+        when concurrent: callers with a key already in flight wait for its
+        result instead of repeating the call. Up to maxsize results are
+        kept, in two generations like normalize.LRUCache. Errors are raised
+        to all callers waiting for them, but not memoized
+    """
+    def __init__(self, func, maxsize=128):
+        self.func = func
+        self.maxsize = maxsize
+        self._current = {}
+        self._old = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, *key):
+        with self._lock:
+            call = self._current.get(key)
+            owner = call is None
+            if owner:
+                call = self._old.pop(key, None)
+                owner = call is None
+                if owner:
+                    call = _Call()
+                if len(self._current) >= self.maxsize // 2:
+                    self._old, self._current = self._current, {}
+                self._current[key] = call
+
+        if owner:
+            try:
+                call.result = self.func(*key)
+            except Exception as e:
+                call.error = e
+                with self._lock:
+                    # It may have been rotated to the old generation already
+                    for calls in (self._current, self._old):
+                        if calls.get(key) is call:
+                            del calls[key]
+            finally:
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def __len__(self):
+        return len(self._current) + len(self._old)
+
+    def clear(self):
+        with self._lock:
+            self._current, self._old = {}, {}
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SharedIterable(object):
+    """ Share an iterator among many consumers, possibly concurrent. Each
+        item is taken from it only once, when first needed by a consumer,
+        and kept for the others, so each one can iterate from the start and
+        stop whenever it wants without loading further items
+    """
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._items = []
+        self._done = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i < len(self._items):
+                yield self._items[i]
+                i += 1
+                continue
+
+            with self._lock:
+                if i < len(self._items):
+                    continue  # taken by another consumer meanwhile
+                if self._done:
+                    return
+                try:
+                    self._items.append(next(self._iterator))
+                except StopIteration:
+                    self._done = True
+                    return
+                except Exception:
+                    self._done = True
+                    raise
@@ -30,10 +30,13 @@ import operator
 import logging
 import json
 import time
-from lxml import html
+import threading
+from array import array
+from lxml import html, etree
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
-from .. import g, datatools as dt
+from .. import g, datatools as dt, httptools
 from . import Provider
 from ..utils import notify, print_debug
 
@@ -48,55 +51,184 @@ log = logging.getLogger(__name__)
 class HttpBot(object):
     """ Base class for other handling basic http tasks like requesting a page,
         download a file and cache content. Not to be used directly
+        Connections are kept alive and reused, up to poolsize idle connections
+        per host, and content is requested gzip-compressed.
     """
-    def __init__(self, base_url=""):
-        self._opener = urllib2.build_opener(urllib2.HTTPCookieProcessor())
+
+    # Time-to-live, in seconds, of cached responses for GET requests, as
+    # (url path prefix, ttl) pairs. URLs not listed here are never cached
+    cache_ttl = ()
+
+    def __init__(self, base_url="", poolsize=4):
+        self.pool = httptools.ConnectionPool(poolsize)
+        self.assets = httptools.AssetFetcher(self.download)
+        self._http_cache = None
+        self._opener = httptools.build_opener(self.pool,
+                                              urllib2.HTTPCookieProcessor())
         scheme, netloc, path, q, f  = urlparse.urlsplit(base_url, "http")
         if not netloc:
             netloc, _, path = path.partition('/')
         self.base_url = urlparse.urlunsplit((scheme, netloc, path, q, f))
 
-    def get(self, url, postdata=None):
+    def get(self, url, postdata=None, headers=None):
         """ Send an HTTP request, either GET (if no postdata) or POST
             Keeps session and other cookies.
             postdata is a dict with name/value pairs
+            headers is a dict of extra request headers. Requests with extra
+            headers are never cached
             url can be absolute or relative to base_url
         """
         url = urlparse.urljoin(self.base_url, url)
-        if postdata:
-            return self._opener.open(url, urllib.urlencode(postdata))
-        else:
+        if postdata or headers:
+            return self._opener.open(urllib2.Request(
+                url,
+                urllib.urlencode(postdata) if postdata else None,
+                headers or {}))
+
+        ttl = self._get_ttl(url)
+        if not ttl:
             return self._opener.open(url)
 
-    def download(self, url, savedir, filename="", overwrite=True):
-        download = self.get(url)
+        # Fresh cached copy, no request at all
+        entry = self.http_cache.lookup(url)
+        if entry and entry['expires'] > time.time():
+            return self.http_cache.open(entry)
 
-        # If save name is not set, use the downloaded file name
-        if not filename:
-            filename = download.geturl().rstrip("/")
+        # Stale copy, revalidate it if server gave us ETag or Last-Modified
+        request = urllib2.Request(url)
+        if entry:
+            for header, value in self.http_cache.validators(entry).iteritems():
+                request.add_header(header, value)
+        try:
+            response = self._opener.open(request)
+        except urllib2.HTTPError as e:
+            if entry and e.code == 304:  # Not Modified
+                e.read()  # so the connection can be reused
+                e.close()
+                return self.http_cache.refresh(entry, ttl, e.info())
+            raise
+
+        return self.http_cache.store(url, response, ttl)
+
+    @property
+    def http_cache(self):
+        if self._http_cache is None:
+            self._http_cache = httptools.HttpCache(
+                os.path.join(g.globals['cache_dir'], 'http'))
+        return self._http_cache
+
+    def _get_ttl(self, url):
+        if not g.options['cache']:
+            return 0
+        path = urlparse.urlsplit(url).path
+        for prefix, ttl in self.cache_ttl:
+            if path.startswith(prefix):
+                return ttl
+        return 0
+
+    def stats(self):
+        """ Return a dict with connection pool and cache counters and the
+            current pool size
+        """
+        stats = dict(self.pool.stats)
+        stats.update(poolsize=self.pool.maxsize, idle=self.pool.size())
+        if self._http_cache is not None:
+            stats.update(('cache_%s' % k, v)
+                         for k, v in self._http_cache.stats.iteritems())
+        return stats
 
+    def download(self, url, savedir, filename="", overwrite=True):
+        """ Download url to savedir, using filename if provided or the one in
+            the (possibly redirected) url. Content is streamed in chunks to a
+            temporary '.part' file, renamed to filename only when complete.
+            A '.part' file left by a failed download is resumed with a single
+            Range request, and restarted if the server does not honor it.
+            As the final name may only be known after redirects, without a
+            filename the '.part' file is named after url itself.
+            If not overwrite and file exists, it's reused.
+            Return the filename (with full path) of the downloaded file
+        """
         # Handle dir
         savedir = os.path.expanduser(savedir)
         if not os.path.isdir(savedir):
             os.makedirs(savedir)
 
+        partfile = os.path.join(savedir, os.path.basename(filename or
+                                                          url.rstrip("/")))
+        partfile += ".part"
+
+        headers = {'Accept-Encoding': 'identity'}
+        offset = os.path.getsize(partfile) if os.path.isfile(partfile) else 0
+        if offset:
+            headers['Range'] = "bytes=%d-" % offset
+        try:
+            download = self.get(url, headers=headers)
+        except urllib2.HTTPError as e:
+            if not offset or e.code != 416:  # Requested Range Not Satisfiable
+                raise
+            # Stale partial file, start over
+            e.read()  # so the connection can be reused
+            e.close()
+            offset = 0
+            del headers['Range']
+            download = self.get(url, headers=headers)
+
+        # If save name is not set, use the downloaded file name
+        if not filename:
+            filename = download.geturl().rstrip("/")
+
         # Combine dir to convert filename to a full path
         filename = os.path.join(savedir, os.path.basename(filename))
 
-        if overwrite or not os.path.isfile(filename):
-            with open(filename,'wb') as f:
-                f.write(download.read())
-        else:
+        if not overwrite and os.path.isfile(filename):
+            download.close()
             log.debug("Using cached file")
+            return filename
+
+        # Resume only if server sent the requested range, otherwise a plain
+        # 200 response has the whole content, so start over
+        info = download.info()
+        mode = 'wb'
+        size = info.getheader('content-length', "")
+        if offset and download.code == 206:  # Partial Content
+            match = re.match(r'bytes\s+(\d+)-\d+/(\d+)',
+                             info.getheader('content-range', ""))
+            if match and int(match.group(1)) == offset:
+                log.debug("Resuming download of '%s' from byte %d",
+                          filename, offset)
+                mode = 'ab'
+                size = match.group(2)
+            else:
+                download.close()
+                del headers['Range']
+                download = self.get(url, headers=headers)
+                size = download.info().getheader('content-length', "")
+        size = int(size) if size.isdigit() else None
 
+        try:
+            with open(partfile, mode) as f:
+                for chunk in iter(lambda: download.read(httptools.CHUNK_SIZE),
+                                  b""):
+                    f.write(chunk)
+        finally:
+            download.close()
+
+        received = os.path.getsize(partfile)
+        if size is not None and received != size:
+            raise urllib2.httplib.IncompleteRead(b"", size - received)
+
+        os.rename(partfile, filename)
         return filename
 
-    def cache(self, url, subdir=""):
-        filename = os.path.join(g.globals['cache_dir'], subdir, os.path.basename(url))
-        if os.path.exists(filename):
-            return True
-        else:
-            return (self.download(url, os.path.join(g.globals['cache_dir'], subdir)))
+    def cache(self, url, subdir="", wait=True, timeout=None):
+        """ Save url in cache dir, unless it's already there, in background.
+            If wait, block up to timeout seconds and return the cached
+            filename, or None if it failed. Otherwise return immediately.
+        """
+        savedir = os.path.join(g.globals['cache_dir'], subdir)
+        if wait:
+            return self.assets.get(url, savedir, timeout)
+        self.assets.fetch(url, savedir)
 
     def quote(self, text):
         """ Quote a text for URL usage, similar to urllib.quote_plus.
@@ -113,6 +245,84 @@ class HttpBot(object):
         return html.parse(self.get(url, postdata),
                           parser=html.HTMLParser(encoding='utf-8'))
 
+class SubtitleRanker(object):
+    """ Scores subtitles for a movie. Features of the movie are computed
+        once, on creation, and subtitles are scored in batches, feature by
+        feature, into arrays of floats. Each subtitle dict is also updated
+        with its 'similarity' (of release) and 'score', in [0, 10] range
+    """
+    # Weight of each feature, all in [0, 1] range, in the score
+    weights = (
+        ('title',     20),  # title similarity
+        ('release',   12),  # release similarity
+        ('highlight',  3),  # highlighted subtitle
+        ('pack',       2),  # subtitle pack
+        ('rating',     2),  # user rating, 0.8 if not rated
+        ('age',        1),  # newer subtitles, if dates span more than 90 days
+    )
+
+    def __init__(self, movie, today=None):
+        self.movie   = movie
+        self.release = movie['release']
+        self.title   = dt.clean_string(movie['title'])
+        self.today   = today or datetime.today()
+        self.total   = sum(weight for _, weight in self.weights)
+
+    def features(self, subtitles):
+        """ Return a dict {feature: array of values, one per subtitle} """
+        columns = dict(
+            title = dt.score_many(self.title,
+                                  [dt.clean_string(s['title'])
+                                   for s in subtitles],
+                                  top=dt.PREFILTER_TOP)['scores'],
+            release = dt.score_many(self.release,
+                                    [dt.clean_string(s['release'])
+                                     for s in subtitles],
+                                    top=dt.PREFILTER_TOP)['scores'],
+            highlight = [1 if s['highlight'] else 0 for s in subtitles],
+            pack      = [1 if s['pack']      else 0 for s in subtitles],
+            rating    = [s['rating']/10 if s['rating'] is not None else 0.8
+                         for s in subtitles],
+        )
+
+        days = [(self.today - s['date']).days for s in subtitles]
+        oldest, newest = max(days), min(days)
+        if oldest - newest > 90:
+            columns['age'] = [1 - (d - newest)/(oldest - newest) for d in days]
+        else:
+            columns['age'] = [1] * len(days)
+
+        return dict((k, array(b'd', v)) for k, v in columns.iteritems())
+
+    def score(self, subtitles):
+        """ Score subtitles, return an array of their scores """
+        if not subtitles:
+            return array(b'd')
+
+        columns = self.features(subtitles)
+        scores = array(b'd', [0]) * len(subtitles)
+        for feature, weight in self.weights:
+            column = columns[feature]
+            for i in xrange(len(scores)):
+                scores[i] += weight * column[i]
+
+        for i, sub in enumerate(subtitles):
+            scores[i] = 10 * scores[i] / self.total
+            sub['similarity'] = columns['release'][i]
+            sub['score'] = scores[i]
+        return scores
+
+    def rank(self, subtitles, top=None, lazy=False):
+        """ Return subtitles sorted by score, greatest first, or only the top
+            ones if top is given. If lazy, return an iterator instead, that
+            orders subtitles only as they are requested
+        """
+        scores = self.score(subtitles)
+        if lazy:
+            return dt.iter_ranked(subtitles, scores)
+        return dt.top_k(subtitles, scores, top)
+
+
 class LegendasTV(HttpBot, Provider):
 
     name = "Legendas.TV"
@@ -120,10 +330,22 @@ class LegendasTV(HttpBot, Provider):
     url_thumbs = "http://i.legendas.tv/poster/214x317/"
 
     _re_sub_language = re.compile(r"idioma/\w+_(\w+)\.")
+    _re_sub_date     = re.compile(r"(\d+)/(\d+)/(\d+) - (\d+):(\d+)")
+
+    # Search results page
+    _xp_rows = etree.XPath(".//article/div[not(starts-with(@class, 'banner'))]")
+    _xp_next = etree.XPath("//a[@class='load_more']/@href")
+
+    cache_ttl = (
+        ("/legenda/sugestao/",           60*60*24),  # title suggestions
+        ("/util/carrega_legendas_busca", 60*60),     # subtitle searches
+    )
 
     def __init__(self):
         super(LegendasTV, self).__init__(self.url)
         self.auth = False
+        self._workers_pool = None
+        self._workers_lock = threading.Lock()
 
     def login(self, login, password):
         if not (login and password):
@@ -303,26 +525,29 @@ class LegendasTV(HttpBot, Provider):
             item = e['_source']
             movie = {k: item.get(v, None) for k, v in mapping.iteritems()}
 
+            # Thumbnail is only fetched when needed, see getThumbnail()
             if movie.get('thumb', None):
                 movie['thumb'] = self.url_thumbs + movie['thumb']
-                if g.options['cache']:
-                    try:
-                        self.cache(movie['thumb'], 'thumbs')
-                    except (urllib2.HTTPError, urllib2.URLError) as e:
-                        log.error("%s\t%s", movie['thumb'], e)
-                        if getattr(e, 'code', 0) not in (404,):  # Page not Found
-                            raise(e)
 
             if movie.get('type', None):
                 movie['type'] = typemap.get(movie['type'], None)
 
             movies.append(movie)
 
-        print_debug("Titles found for '%s':\n%s" % (text,
-                                                    dt.print_dictlist(movies)))
+        print_debug("Titles found for '%s':\n%s", text,
+                    dt.lazy_dictlist(movies))
         return movies
 
 
+    def getThumbnail(self, movie, timeout=10):
+        """ Return the local filename of a movie thumbnail, fetching it to the
+            cache if needed, or an empty string if it's not available
+        """
+        if not (movie.get('thumb') and g.options['cache']):
+            return ""
+        return self.cache(movie['thumb'], 'thumbs', timeout=timeout) or ""
+
+
     """ Convenience wrappers for the main getSubtitles method """
 
     def getSubtitlesByMovie(self, movie, stype=None, lang=None, allpages=True):
@@ -343,8 +568,20 @@ class LegendasTV(HttpBot, Provider):
                                  lang=lang,
                                  allpages=allpages)
 
+    def iterSubtitlesByMovie(self, movie, stype=None, lang=None, allpages=True):
+        return self.iterSubtitles(movie_id=movie['id'],
+                                  stype=stype,
+                                  lang=lang,
+                                  allpages=allpages)
+
+    def iterSubtitlesByText(self, text, stype=None, lang=None, allpages=True):
+        return self.iterSubtitles(text=text,
+                                  stype=stype,
+                                  lang=lang,
+                                  allpages=allpages)
+
     def getSubtitles(self, text="", stype=None, lang=None, movie_id=None,
-                       allpages=True):
+                       allpages=True, prefetch=None):
         """ Main method for searching, parsing and retrieving subtitles info.
             Arguments:
             text  - The text to search for
@@ -355,13 +592,37 @@ class LegendasTV(HttpBot, Provider):
                       in constants
             movie_id - search all subtitles from the specified movie. If used,
                        text and type (but not lang) are ignored
+            allpages - follow "load more" links to retrieve all result pages
+            prefetch - number of result pages to request in parallel, once
+                       the page url pattern is known. None for the default,
+                       pages_prefetch. 0 or 1 loads one page at a time
             Either text or movie_id must be provided
             Return a list of dictionaries with the subtitles found. Some info
             is related to the movie, not to that particular subtitle
         """
+        subtitles = [sub for page in self.iterSubtitles(text, stype, lang,
+                                                        movie_id, allpages,
+                                                        prefetch)
+                     for sub in page]
+
+        print_debug("Subtitles found for %s:\n%s",
+                    movie_id or "'%s'" % text, dt.lazy_dictlist(subtitles))
+        return subtitles
+
+
+    def iterSubtitles(self, text="", stype=None, lang=None, movie_id=None,
+                        allpages=True, prefetch=None):
+        """ Generator version of getSubtitles(), same arguments.
+            Yield a list of the subtitles found in each result page, as soon
+            as it is parsed. Further pages are only loaded as the iteration
+            goes on, so the caller can stop it once satisfied
+        """
         if lang is None:
             lang = g.options['language'] or ""
 
+        if prefetch is None:
+            prefetch = self.pages_prefetch
+
         # Convert 2-char language ISO code to lang_id used in search
         lang_id = self.languages.get(lang, {}).get('id', 0)
 
@@ -370,8 +631,6 @@ class LegendasTV(HttpBot, Provider):
         for lang_iso, language in self.languages.iteritems():
             languages[language['code']] = lang_iso
 
-        subtitles = []
-
         url = "/util/carrega_legendas_busca"
         if movie_id:  url += "_filme/"     + str(movie_id)
         else:         url += "/"           + self.quote(text.strip())
@@ -384,65 +643,148 @@ class LegendasTV(HttpBot, Provider):
         if stype:
             url += "/" + stype
 
-        page = 0
-        lastpage = False
-        while not lastpage:
-            page += 1
-            log.debug("loading %s", url)
-            try:
-                tree = self.parse(url)
-            except (urllib2.HTTPError, urllib2.httplib.BadStatusLine) as e:
-                notify("Server error retrieving URL!")
-                log.error(e)
-                break
-
-            # <div class="">
-            #     <span class="number number_2">35</span>
-            #     <div class="f_left">
-            #         <p><a href="/download/c0c4d6418a3474b2fb4e9dae3f797bd4/Gattaca/gattaca_dvdrip_divx61_ac3_sailfish">gattaca_dvdrip_divx61_ac3_(sailfish)</a></p>
-            #         <p class="data">1210 downloads, nota 10, enviado por <a href="/usuario/SuperEly">SuperEly</a> em 02/11/2006 - 16:13 </p>
-            #     </div>
-            #     <img src="/img/idioma/icon_brazil.png" alt="Portugu&#234;s-BR" title="Portugu&#234;s-BR">
-            # </div>
-            for e in tree.xpath(".//article/div"):
-                if e.attrib['class'].startswith('banner'): continue
-                data = e.xpath(".//text()")
-                dataurl = e.xpath(".//a")[0].attrib['href'].split('/')
-                dataline = data[2].split(' ')
-                sub = dict(
-                    hash        = dataurl[2],
-                    title       = dataurl[3],
-                    downloads   = dataline[0],
-                    rating      = dataline[3][:-1] or None,
-                    date        = data[4].strip()[3:],
-                    user_name   = data[3],
-                    release     = data[1],
-                    pack        = e.attrib['class'] == 'pack',
-                    highlight   = e.attrib['class'] == 'destaque',
-                    flag        = e.xpath("./img")[0].attrib['src']
-                )
-                dt.fields_to_int(sub, 'downloads', 'rating')
-                sub['language'] = languages.get(re.search(self._re_sub_language,
-                                                          sub['flag']).group(1))
-                sub['date'] = datetime.strptime(sub['date'], '%d/%m/%Y - %H:%M')
-                if sub['release'].startswith("(p)") and sub['pack']:
-                    sub['release'] = sub['release'][3:]
-
-                if g.options['cache']: self.cache(sub['flag'])
-                subtitles.append(sub)
-
-            # Page control
-            if not allpages:
-                lastpage = True
-            else:
-                nextpage = tree.xpath("//a[@class='load_more']")
-                if nextpage:
-                    url = nextpage[0].attrib['href']
-                else:
-                    lastpage = True
+        for tree in self._iter_pages(url, allpages, prefetch):
+            yield self._parse_subtitles(tree, languages)
+
+
+    # Number of search result pages requested in parallel by getSubtitles()
+    pages_prefetch = 4
+
+    def _load_page(self, url, missing_ok=False):
+        """ Parse a search results page, or return None on server errors.
+            If missing_ok, a 404 (Not Found) is silently treated as no page
+        """
+        log.debug("loading %s", url)
+        try:
+            return self.parse(url)
+        except (urllib2.HTTPError, urllib2.httplib.BadStatusLine) as e:
+            if missing_ok and getattr(e, 'code', 0) == 404:
+                return None
+            notify("Server error retrieving URL!")
+            log.error(e)
+            return None
+
+    def _next_page(self, tree):
+        """ Absolute url of the "load more" link in a results page, if any """
+        nextpage = self._xp_next(tree)
+        if nextpage:
+            return urlparse.urljoin(self.base_url, nextpage[0])
+
+    def _page_pattern(self, url):
+        """ Infer the page url pattern from a "load more" url, assuming its
+            last all-digits path segment is the page number.
+            Return a 2-tuple (function(page) -> url, page), or (None, 0)
+        """
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        parts = path.split('/')
+        for i in reversed(xrange(len(parts))):
+            if parts[i].isdigit():
+                head = urlparse.urlunsplit((scheme, netloc,
+                                            '/'.join(parts[:i] + [""]), "", ""))
+                tail = urlparse.urlunsplit(("", "",
+                                            '/'.join([""] + parts[i+1:]),
+                                            query, fragment))
+                return (lambda page: "%s%d%s" % (head, page, tail)), int(parts[i])
+        return None, 0
+
+    def _workers(self):
+        with self._workers_lock:
+            if self._workers_pool is None:
+                self._workers_pool = ThreadPool(max(self.pages_prefetch, 2))
+        return self._workers_pool
+
+    def _iter_pages(self, url, allpages=True, prefetch=0):
+        """ Yield the parsed tree of each search results page, in order,
+            starting at url and, if allpages, following "load more" links.
+            With prefetch > 1, the next prefetch pages are requested in
+            parallel based on the url pattern inferred from the first link,
+            stopping at the first empty or missing page. Whenever the actual
+            links do not match the pattern it falls back to following them.
+        """
+        tree = self._load_page(url)
+        if tree is None:
+            return
+        yield tree
+
+        nexturl = self._next_page(tree) if allpages else None
+        while nexturl:
+            pageurl, page = (self._page_pattern(nexturl) if prefetch > 1
+                             else (None, 0))
+            if not pageurl:
+                tree = self._load_page(nexturl)
+                if tree is None:
+                    return
+                yield tree
+                nexturl = self._next_page(tree)
+                continue
+
+            urls = [pageurl(page + i) for i in xrange(prefetch + 1)]
+            results = [self._workers().apply_async(self._load_page, (u, True))
+                       for u in urls[:-1]]
+            for i, result in enumerate(results):
+                tree = result.get()
+                if tree is None or not self._rows(tree):
+                    return
+                yield tree
+                nexturl = self._next_page(tree)
+                if nexturl != urls[i+1]:
+                    break  # last page, or pattern mismatch
+
+
+    def _rows(self, tree):
+        return self._xp_rows(tree)
+
+    def _parse_date(self, text):
+        """ Parse a 'dd/mm/yyyy - HH:MM' date, as in results pages """
+        match = self._re_sub_date.search(text)
+        if match:
+            day, month, year, hour, minute = map(int, match.groups())
+            return datetime(year, month, day, hour, minute)
+        return datetime.strptime(text.strip()[3:], '%d/%m/%Y - %H:%M')
+
+    def _parse_subtitles(self, tree, languages):
+        """ Return a list of subtitle dicts from a search results page.
+            languages maps flag codes to 2-char language ISO codes
+        """
+        subtitles = []
+
+        # <div class="">
+        #     <span class="number number_2">35</span>
+        #     <div class="f_left">
+        #         <p><a href="/download/c0c4d6418a3474b2fb4e9dae3f797bd4/Gattaca/gattaca_dvdrip_divx61_ac3_sailfish">gattaca_dvdrip_divx61_ac3_(sailfish)</a></p>
+        #         <p class="data">1210 downloads, nota 10, enviado por <a href="/usuario/SuperEly">SuperEly</a> em 02/11/2006 - 16:13 </p>
+        #     </div>
+        #     <img src="/img/idioma/icon_brazil.png" alt="Portugu&#234;s-BR" title="Portugu&#234;s-BR">
+        # </div>
+        for e in self._rows(tree):
+            # Each row is traversed once for its texts, and the first link
+            # and the flag image are found by C-level ElementPath lookups
+            data = list(e.itertext())
+            dataurl = e.find(".//a").get('href').split('/')
+            dataline = data[2].split(' ')
+            rowclass = e.get('class', "")
+            flag = e.find("img").get('src')
+            rating = dataline[3][:-1]
+            sub = dict(
+                hash        = dataurl[2],
+                title       = dataurl[3],
+                downloads   = int(dataline[0]),
+                rating      = int(rating) if rating else None,
+                date        = self._parse_date(data[4]),
+                user_name   = data[3],
+                release     = data[1],
+                pack        = rowclass == 'pack',
+                highlight   = rowclass == 'destaque',
+                flag        = flag,
+                language    = languages.get(
+                                self._re_sub_language.search(flag).group(1)),
+            )
+            if sub['release'].startswith("(p)") and sub['pack']:
+                sub['release'] = sub['release'][3:]
+
+            if g.options['cache']: self.cache(sub['flag'], wait=False)
+            subtitles.append(sub)
 
-        print_debug("Subtitles found for %s:\n%s" %
-                   ( movie_id or "'%s'" % text, dt.print_dictlist(subtitles)))
         return subtitles
 
 
@@ -456,55 +798,36 @@ class LegendasTV(HttpBot, Provider):
             log.warn("Subtitle download requires user to be logged in")
 
         url = '/downloadarquivo/%s' % filehash
-        print_debug("Downloading archive for subtitle from %s" % url)
+        print_debug("Downloading archive for subtitle from %s", url)
 
         try:
             result = self.download(url, savedir, basename, overwrite=overwrite)
-        except (urllib2.HTTPError, urllib2.httplib.BadStatusLine) as e:
+        except (urllib2.HTTPError,
+                urllib2.httplib.BadStatusLine,
+                urllib2.httplib.IncompleteRead) as e:
             log.error(e)
             return
 
-        print_debug("Archive saved as '%s'" % (result))
+        print_debug("Archive saved as '%s'", result)
         return result
 
-    def rankSubtitles(self, movie, subtitles):
+    def rankSubtitles(self, movie, subtitles, top=None, lazy=False):
         """ Evaluates each subtitle based on wanted movie and give each a score.
-            Return the list sorted by score, greatest first
+            Return the list sorted by score, greatest first, or only the top
+            ones, or, if lazy, an iterator that sorts them as consumed.
+            With more than dt.PREFILTER_TOP subtitles, only the top ones by
+            shared trigrams get a title or release similarity, the others
+            score 0.0 in those features, so they rank after them.
+            See SubtitleRanker
         """
 
         if not subtitles:
             return
 
-        def days(d):
-            return (datetime.today() - d).days
-
-        oldest = days(min([s['date'] for s in subtitles]))
-        newest = days(max([s['date'] for s in subtitles]))
-
-        for sub in subtitles:
-            sub['similarity'] = dt.get_similarity(movie['release'],
-                                                  dt.clean_string(sub['release']))
-
-            score = 0
-
-            score += 20 * dt.get_similarity(dt.clean_string(movie['title']),
-                                            dt.clean_string(sub['title']))
-            score += 12 * sub['similarity']
-            score +=  3 * 1 if sub['highlight'] else 0
-            score +=  2 * 1 if sub['pack'] else 0
-            score +=  2 * (sub['rating']/10
-                           if sub['rating'] is not None
-                           else 0.8)
-            score +=  1 * (1 - ( (days(sub['date'])-newest)/(oldest-newest)
-                                 if (oldest - newest) > 90
-                                 else 0 ))
-
-            sub['score'] = 10 * score / 40
-
-        result = sorted(subtitles, key=operator.itemgetter('score'),
-                        reverse=True)
-        print_debug("Ranked subtitles for %s:\n%s" % (movie,
-                                                      dt.print_dictlist(result)))
+        result = SubtitleRanker(movie).rank(subtitles, top, lazy)
+        if not lazy:
+            print_debug("Ranked subtitles for %s:\n%s", movie,
+                        dt.lazy_dictlist(result))
         return result
 
 
@@ -518,6 +841,11 @@ class LegendasTV(HttpBot, Provider):
 
 
     def rankMovies(self, movie, movies):
+        """ Score each movie by its year, type and title similarity to the
+            wanted movie, and return them sorted by score, greatest first.
+            With more than dt.PREFILTER_TOP movies, only the top ones by
+            shared trigrams get a title similarity, the others have 0.0
+        """
         year = movie.get('year', None)
         title = dt.clean_string(movie['title'])
         mtype = 'movie'
@@ -529,10 +857,14 @@ class LegendasTV(HttpBot, Provider):
         max_score = sum((max(w) for w in points.itervalues()))
         min_score = sum((min(w) for w in points.itervalues()))
 
-        for m in movies:
+        similarities = dt.score_many(title,
+                                     [dt.clean_string(m['title'])
+                                      for m in movies],
+                                     top=dt.PREFILTER_TOP)['scores']
+
+        for m, s in zip(movies, similarities):
             y = m.get('year', None)
             t = m.get('type', None)
-            s = dt.get_similarity(title, dt.clean_string(m['title']))
 
             score = 0
             score += self._matching_points(year,  y, points['year'])
@@ -546,9 +878,8 @@ class LegendasTV(HttpBot, Provider):
                         key=operator.itemgetter('score'),
                         reverse=True)
 
-        print_debug("Ranked movies for %s:\n%s" %
-                    (movie,
-                     dt.print_dictlist(result)))
+        print_debug("Ranked movies for %s:\n%s", movie,
+                    dt.lazy_dictlist(result))
 
         return result
 
@@ -23,15 +23,27 @@ from __future__ import unicode_literals
 import xmlrpclib
 import socket
 import httplib
-import struct
+import base64
+import binascii
+import zlib
+import re
 import os
 import json
 import time
+import atexit
+import tempfile
+import threading
 import logging
 
 log = logging.getLogger(__name__)
 
-from .. import g, datatools as dt
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+from .. import g, datatools as dt, hashtools
+from ..httptools import CHUNK_SIZE
 from . import Provider
 from ..utils import print_debug
 
@@ -40,22 +52,215 @@ class OpenSubtitlesError(Exception):
     pass
 
 
+# Sessions expire after 15 minutes of inactivity. Refresh a bit earlier
+SESSION_TIMEOUT = 14 * 60
+
+# After a failed login, do not try again for a while, so calls made while
+# OSDB is down or rejecting the credentials do not each hammer it with one
+LOGIN_RETRY = 60
+
+
+class Unmarshaller(object):
+    """ Fast XML-RPC response parser, a drop-in replacement for xmlrpclib's
+        parser and unmarshaller pair. Data is fed to an lxml pull parser that
+        only reports the closing of value, member, array and struct elements,
+        and results are built incrementally on a flat stack: arrays and
+        structs pop their items when they close, and are cleared right away
+        to keep memory usage low. close() returns the params tuple, or raises
+        xmlrpclib.Fault
+    """
+    def __init__(self, use_datetime=0):
+        self._parser = etree.XMLPullParser(events=('end',), huge_tree=True,
+                                           tag=('value', 'member', 'data',
+                                                'struct', 'fault'))
+        self._stack  = []
+        self._fault  = False
+        self._result = None
+
+        if use_datetime:
+            datetime = xmlrpclib._datetime_type
+        else:
+            datetime = xmlrpclib.DateTime
+        self._types = {
+            'int'             : int,
+            'i4'              : int,
+            'i8'              : int,
+            'boolean'         : self._boolean,
+            'double'          : float,
+            'nil'             : lambda text: None,  # @UnusedVariable
+            'dateTime.iso8601': datetime,
+            'base64'          : lambda text: xmlrpclib.Binary(
+                                    base64.decodestring(text or b"")),
+        }
+
+    @staticmethod
+    def _boolean(text):
+        if text not in ("0", "1"):
+            raise TypeError("bad boolean value")
+        return text == "1"
+
+    def feed(self, data):
+        self._parser.feed(data)
+        stack = self._stack
+        for _, elem in self._parser.read_events():
+            tag = elem.tag
+            if tag == 'value':
+                if not len(elem):
+                    # <value> with no type element is a string
+                    stack.append(elem.text or b"")
+                    continue
+                child = elem[0]
+                tag = child.tag
+                if tag == 'string':
+                    stack.append(child.text or b"")
+                elif tag != 'array' and tag != 'struct':  # already stacked
+                    stack.append(self._types[tag](child.text))
+
+            elif tag == 'member':
+                stack[-1] = (elem[0].text or b"", stack[-1])  # <name>
+
+            elif tag == 'fault':
+                self._fault = True
+
+            else:  # array <data> or <struct>
+                size = len(elem)
+                items = stack[-size:] if size else ()
+                if size:
+                    del stack[-size:]
+                stack.append(dict(items) if tag == 'struct' else list(items))
+                elem.clear()
+
+    def close(self):
+        if self._result is None:
+            self.feed(b"")
+            self._parser.close()
+            self._result = tuple(self._stack)
+        if self._fault:
+            raise xmlrpclib.Fault(**self._result[0])
+        return self._result
+
+
+class OsdbTransport(xmlrpclib.Transport):
+    """ XML-RPC transport with a per-request timeout, instead of the global
+        socket default, and gzip-compressed requests. As in the base class,
+        the HTTP connection is kept alive between calls and responses are
+        gzip-compressed. Not thread-safe, use one instance per thread.
+    """
+    encode_threshold = 1024  # gzip requests larger than this, in bytes
+
+    def __init__(self, timeout=None, use_datetime=0):
+        xmlrpclib.Transport.__init__(self, use_datetime)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        chost, self._extra_headers, _ = self.get_host_info(host)
+        self._connection = host, httplib.HTTPConnection(chost,
+                                                        timeout=self.timeout)
+        return self._connection[1]
+
+    def getparser(self):
+        if etree is None:
+            return xmlrpclib.Transport.getparser(self)
+        unmarshaller = Unmarshaller(self._use_datetime)
+        return unmarshaller, unmarshaller
+
+    def parse_response(self, response):
+        # Same as base class, but reads in larger chunks and decodes gzip
+        # while parsing, instead of buffering the whole response first
+        if (hasattr(response, 'getheader') and
+            response.getheader("Content-Encoding", "") == "gzip"):
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            decoder = None
+
+        p, u = self.getparser()
+        for data in iter(lambda: response.read(CHUNK_SIZE), b""):
+            if decoder:
+                data = decoder.decompress(data)
+            if self.verbose:
+                print "body:", repr(data)
+            p.feed(data)
+        if decoder:
+            p.feed(decoder.flush())
+        p.close()
+
+        return u.close()
+
+
 class Osdb(object):
-    def __init__(self, username="", password="", language=""):
-        self.osdb = xmlrpclib.ServerProxy('http://api.opensubtitles.org/xml-rpc')
-        self.username = None
-        self.language = None
-        self.account  = None
-        self.token    = None
+
+    xmlrpc_url = 'http://api.opensubtitles.org/xml-rpc'
+
+    # Timeout, in seconds, for each XML-RPC call
+    timeout = 5
+
+    def __init__(self, username="", password="", language="", login=True):
+        self.username  = username
+        self.language  = language
+        self.account   = None
+        self.token     = None
+        self.last_used = 0
+        self.stats     = {}
+        self.failed    = 0  # time of the last failed login
+        self._password = password
+        self._lock     = threading.RLock()
+        self._local    = threading.local()
+        if login:
+            self._login()
+
+
+    @property
+    def osdb(self):
+        """ XML-RPC server proxy, one per thread, so calls run concurrently,
+            each thread on its own keep-alive connection
+        """
+        proxy = getattr(self._local, 'proxy', None)
+        if proxy is None:
+            proxy = xmlrpclib.ServerProxy(self.xmlrpc_url,
+                                          OsdbTransport(self.timeout))
+            self._local.proxy = proxy
+        return proxy
+
+
+    def latency(self):
+        """ Return a dict of per-method call statistics: number of 'calls',
+            'errors', and 'total', 'average' and 'max' latency in seconds
+        """
+        with self._lock:
+            stats = dict((name, dict(stat)) for name, stat
+                         in self.stats.iteritems())
+        for stat in stats.itervalues():
+            stat['average'] = stat['total'] / (stat['calls'] or 1)
+        return stats
+
+
+    def _count(self, name, elapsed, error=False):
+        with self._lock:
+            stat = self.stats.setdefault(name, dict(calls=0, errors=0,
+                                                    total=0.0, max=0.0))
+            stat['calls']  += 1
+            stat['errors'] += int(error)
+            stat['total']  += elapsed
+            stat['max']     = max(stat['max'], elapsed)
+
+
+    def _login(self):
+        if time.time() - self.failed < LOGIN_RETRY:
+            log.debug("OSDB login failed recently, not trying again yet")
+            return
         try:
-            self.LogIn(username, password, language)
+            self.LogIn(self.username, self._password, self.language)
         except (xmlrpclib.Error, OpenSubtitlesError) as e:
+            self.failed = time.time()
             log.warn("Could not login to OSDB, some services may not work: %s", e)
 
 
     def LogIn(self, username="", password="", language=""):
-        self.username = username
-        self.language = language
+        self.username  = username
+        self.language  = language
+        self._password = password
         res = self._osdb_call(
             "LogIn",
             self.username,
@@ -73,6 +278,12 @@ class Osdb(object):
             self.token = None
 
 
+    def expired(self):
+        """ True if session token is missing or too old to be trusted """
+        return (not self.token or
+                time.time() - self.last_used > SESSION_TIMEOUT)
+
+
     def GetSubLanguages(self, language=None):
         if language is None:
             language = self.language
@@ -87,6 +298,30 @@ class Osdb(object):
 
 
     def _osdb_call(self, name, *args):
+        nosession = ('ServerInfo', 'GetSubLanguages', 'LogIn', 'LogOut')
+
+        # Refresh the session token before it expires
+        if name not in nosession and self.expired():
+            with self._lock:
+                if self.expired():
+                    self._login()
+
+        token = self.token
+        try:
+            return self._osdb_call_once(name, *args)
+        except OpenSubtitlesError as e:
+            # Session rejected by the server, log in again and retry once
+            if name in nosession or not e.args[0].endswith(
+                    ("401 Unauthorized", "406 No session")):
+                raise
+            with self._lock:
+                if self.token == token:
+                    log.debug("OSDB session expired, logging in again")
+                    self._login()
+            return self._osdb_call_once(name, *args)
+
+
+    def _osdb_call_once(self, name, *args):
         nostatus = ('ServerInfo', 'GetSubLanguages')
         notoken  = nostatus + ('LogIn',)
 
@@ -104,26 +339,27 @@ class Osdb(object):
             logargs = args
 
         # Do the XML-RPC call
+        start = time.time()
         try:
-            timeout = socket.getdefaulttimeout()
-            socket.setdefaulttimeout(5)
             res = getattr(self.osdb, name)(*args)
         except (socket.error,
-                httplib.ResponseNotReady,
+                httplib.HTTPException,
                 xmlrpclib.ProtocolError) as e:
             # most likely [Errno 110] Connection timed out
+            self._count(name, time.time() - start, error=True)
             raise OpenSubtitlesError("OSDB.%s%r: %s" % (name, logargs, e))
-        finally:
-            socket.setdefaulttimeout(timeout)
-
-        if name == 'LogIn' and 'token' in res:
-            logres = res.copy()
-            logres['token'] = '***'
-        else:
-            logres = res
+        self._count(name, time.time() - start)
 
+        if name != 'LogOut':
+            self.last_used = time.time()
 
-        log.debug("OSDB.%s%r -> %r", name, logargs, logres)
+        if log.isEnabledFor(logging.DEBUG):
+            if name == 'LogIn' and 'token' in res:
+                logres = res.copy()
+                logres['token'] = '***'
+            else:
+                logres = res
+            log.debug("OSDB.%s%r -> %r", name, logargs, logres)
 
         # Check for result error status
         if name not in nostatus and not res.get('status', "").startswith("200"):
@@ -143,9 +379,70 @@ class Osdb(object):
 
 
     def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
         return lambda *args: self._osdb_call(name, *args)
 
 
+_sessions = {}
+_sessions_lock = threading.Lock()
+_sessions_file = os.path.join(g.globals['cache_dir'], "osdb_sessions.json")
+
+
+def session(username="", password="", language=""):
+    """ Return a process-wide, thread-safe Osdb instance for username.
+        The session token is shared by all callers and refreshed on expiry,
+        and it is saved on exit, so a following run within its validity
+        window reuses it instead of logging in again
+    """
+    key = "%s:%s" % (username, language)
+    with _sessions_lock:
+        osdb = _sessions.get(key)
+        if osdb is not None:
+            return osdb
+
+        if not _sessions:
+            atexit.register(_save_sessions)
+
+        osdb = Osdb(username, password, language, login=False)
+        try:
+            with open(_sessions_file) as f:
+                saved = json.load(f)[key]
+            osdb.token     = saved['token']
+            osdb.account   = saved['account']
+            osdb.last_used = saved['last_used']
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+        if osdb.expired():
+            osdb._login()
+        else:
+            log.debug("Reusing saved OSDB session for '%s'", username)
+
+        _sessions[key] = osdb
+        return osdb
+
+
+def _save_sessions():
+    with _sessions_lock:
+        sessions = dict((key, dict(token     = osdb.token,
+                                   account   = osdb.account,
+                                   last_used = osdb.last_used))
+                        for key, osdb in _sessions.iteritems()
+                        if not osdb.expired())
+    # mkstemp() creates it readable by the user only, tokens are credentials
+    try:
+        fd, tmpname = tempfile.mkstemp(suffix=".part",
+                                       dir=os.path.dirname(_sessions_file))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(sessions, f)
+            os.rename(tmpname, _sessions_file)
+        except BaseException:
+            os.remove(tmpname)
+            raise
+    except (IOError, OSError) as e:
+        log.warn("Could not save OSDB sessions: %s", e)
 
 
 class OpenSubtitles(Osdb, Provider):
@@ -262,13 +559,40 @@ class OpenSubtitles(Osdb, Provider):
         return json.loads(json.dumps(languages))
 
 
+    # Maximum number of inputs sent in a single API call
+    guess_chunksize  = 20  # texts, GuessMovieFromString
+    search_chunksize = 20  # queries, SearchSubtitles
+
     def getMovies(self, text):
         """ Given a search text, return a list of dicts with basic movie info:
             id, title, year, type
         """
-        movies = []
+        return self.getMoviesMany([text])[text]
+
+
+    def getMoviesMany(self, texts):
+        """ Batch version of getMovies(), guessing several texts with one
+            GuessMovieFromString call per guess_chunksize texts.
+            Return a dict {text: list of movies}, as getMovies() would
+        """
+        result = {}
+        texts = sorted(set(texts))
+        for i in xrange(0, len(texts), self.guess_chunksize):
+            chunk = texts[i:i+self.guess_chunksize]
+            guesses = self.GuessMovieFromString(chunk)
+            if not isinstance(guesses, dict):
+                guesses = {}
+            for text in chunk:
+                result[text] = movies = self._guess_to_movies(guesses.get(text))
+                print_debug("Titles found for '%s':\n%s", text,
+                            dt.lazy_dictlist(movies))
+        return result
+
+
+    def _guess_to_movies(self, item):
+        if not item:
+            return []
 
-        item = self.GuessMovieFromString([text])[text]
         if 'BestGuess' in item:
             item = item['BestGuess']
             mapping = dict(
@@ -280,7 +604,7 @@ class OpenSubtitles(Osdb, Provider):
                 episode  = "SeriesEpisode",
                 imdb_id  = "IDMovieIMDB",
             )
-        else:
+        elif 'GuessIt' in item:
             item = item['GuessIt']
             mapping = dict(
                 id       = "",
@@ -291,11 +615,38 @@ class OpenSubtitles(Osdb, Provider):
                 episode  = "episode",
                 imdb_id  = "",
             )
+        else:
+            return []
+
+        return [{k: item.get(v, None) for k, v in mapping.iteritems()}]
 
-        movies.append({k: item.get(v, None) for k, v in mapping.iteritems()})
-        print_debug("Titles found for '{}':\n{}".format(
-                        text, dt.print_dictlist(movies)))
-        return movies
+
+    def getSubtitlesMany(self, queries):
+        """ Run several SearchSubtitles queries, sending up to
+            search_chunksize of them in each call. queries is either a dict
+            {key: query} or a sequence of queries, each a dict of
+            SearchSubtitles criteria (sublanguageid, moviehash, query, ...).
+            Return a dict {key: list of subtitles}, keyed by the given keys,
+            or by query index if a sequence was given. Results are split
+            among queries using the QueryNumber field the server adds
+        """
+        if isinstance(queries, dict):
+            items = queries.items()
+        else:
+            items = list(enumerate(queries))
+
+        result = dict((key, []) for key, _ in items)
+        for i in xrange(0, len(items), self.search_chunksize):
+            chunk = items[i:i+self.search_chunksize]
+            for sub in self.SearchSubtitles([q for _, q in chunk]) or []:
+                try:
+                    key = chunk[int(sub.get('QueryNumber', 0))][0]
+                except (ValueError, IndexError):
+                    log.warn("Invalid QueryNumber in OSDB result: %r",
+                             sub.get('QueryNumber'))
+                    continue
+                result[key].append(sub)
+        return result
 
 
     """ Convenience wrappers for the main getSubtitles method """
@@ -360,10 +711,10 @@ class OpenSubtitles(Osdb, Provider):
 #                 'query':         text or title['MovieName'],
 #                 'tag':           os.path.basename(vpath or '') or None,
 #             }]))
-            for sub in self.SearchSubtitles([{
+            for sub in self.getSubtitlesMany([{
                 'sublanguageid': lang,
                 'tag':           os.path.basename(vpath or '') or None,
-            }]):
+            }])[0]:
 
 #                 sub = dict(
 #                     hash        = dataurl[2],
@@ -394,46 +745,189 @@ class OpenSubtitles(Osdb, Provider):
 
 
 
-def videohash(filename):
-
-    block = 65536
-    fmt = b"<%dQ" % (block//8) # unsigned long long little endian
-    vhash = os.path.getsize(filename) # initial value for hash is file size
+    def downloadSubtitle(self, subid, savedir, basename="", overwrite=True):
+        """ Download a subtitle file based on its IDSubtitleFile.
+            Saves it as dir/basename, using the basename provided or,
+            if empty, "<subid>.srt".
+            Return the filename (with full path) of the downloaded subtitle,
+            or None on errors
+        """
+        return self.downloadSubtitles({subid: basename}, savedir,
+                                      overwrite).get(subid)
 
-    def partialhash(f):
-        return sum(struct.unpack(fmt, f.read(block)))
 
-    with open(filename, "rb") as f:
+    def downloadSubtitles(self, subtitles, savedir, overwrite=True):
+        """ Batch version of downloadSubtitle(). subtitles is a dict
+            {IDSubtitleFile: basename}. Return a dict {subid: filename}
+            of the subtitles successfully downloaded
+        """
         try:
-            vhash += partialhash(f)
-            f.seek(-block, os.SEEK_END)
-            vhash += partialhash(f)
-            vhash &= 0xFFFFFFFFFFFFFFFF # to remain as 64bit number
-        except (IOError, struct.error):
-            raise OpenSubtitlesError("File '%s' must be at least %d bytes" %
-                                     (filename, block))
-    return b"%016x" % vhash
+            return download_subtitles(subtitles, savedir, self, overwrite)
+        except OpenSubtitlesError as e:
+            log.error(e)
+            return {}
+
+
+DOWNLOAD_CHUNKSIZE = 20  # Maximum subtitles per DownloadSubtitles call
+DECODE_CHUNKSIZE = 4 * 16384  # Base64 characters decoded at a time
+
+
+def download_subtitles(subtitles, savedir, osdb=None, overwrite=True):
+    """ Download several subtitle files, with one DownloadSubtitles call per
+        DOWNLOAD_CHUNKSIZE subtitles. subtitles is a dict
+        {IDSubtitleFile: basename}, an empty basename meaning "<id>.srt".
+        Each base64-encoded gzip payload is decoded straight to its file,
+        in chunks, and released before decoding the next one.
+        Unless overwrite, subtitles already saved are not requested again.
+        Return a dict {subid: filename} of the subtitles saved.
+        Raise OpenSubtitlesError on API errors
+    """
+    from .. import filetools
+    filetools.safemakedirs(savedir)
+
+    result = {}
+    pending = {}
+    for subid, basename in subtitles.iteritems():
+        subid = unicode(subid)
+        filename = os.path.join(savedir, basename or "%s.srt" % subid)
+        if not overwrite and os.path.isfile(filename):
+            result[subid] = filename
+        else:
+            pending[subid] = filename
+
+    if pending and osdb is None:
+        osdb = session(g.options['osdb_username'], g.options['osdb_password'])
+
+    subids = sorted(pending)
+    for i in xrange(0, len(subids), DOWNLOAD_CHUNKSIZE):
+        items = osdb.DownloadSubtitles(subids[i:i+DOWNLOAD_CHUNKSIZE]) or []
+        while items:
+            item = items.pop()
+            subid = unicode(item.get('idsubtitlefile', ""))
+            if subid not in pending:
+                log.warn("Unexpected subtitle id in OSDB download: %r", subid)
+                continue
+            data = item.pop('data', None)
+            if not data:
+                log.error("Could not save subtitle %s: no data in OSDB reply",
+                          subid)
+                continue
+            try:
+                _decode_subtitle(data, pending[subid])
+            except (EnvironmentError, binascii.Error, zlib.error) as e:
+                log.error("Could not save subtitle %s: %s", subid, e)
+                continue
+            result[subid] = pending[subid]
+
+    return result
 
 
-def videoinfo(filename, osdb=None):
-    result = []
-    if osdb is None:
-        osdb = Osdb()
+def _decode_subtitle(data, filename):
+    """ Decode a base64-encoded gzip payload to filename, chunk by chunk """
+    if re.search(r'\s', data):
+        data = b"".join(data.split())
+
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    with open(filename + ".part", 'wb') as f:
+        for i in xrange(0, len(data), DECODE_CHUNKSIZE):
+            f.write(decoder.decompress(
+                binascii.a2b_base64(data[i:i+DECODE_CHUNKSIZE])))
+        f.write(decoder.flush())
+    os.rename(filename + ".part", filename)
+
+
+def videohash(filename):
     try:
-        vhash = videohash(filename)
-        result = osdb.CheckMovieHash2([vhash])
-        if result:
+        return hashtools.videohash(filename)
+    except (EnvironmentError, ValueError) as e:
+        raise OpenSubtitlesError(e)
+
+
+# How long, in seconds, cached hash lookups are trusted
+INFO_TTL       = 60*60*24*30  # 30 days
+INFO_TTL_EMPTY = 60*60*24     # 1 day, for hashes OSDB did not know about
+
+
+def videoinfo(filename, osdb=None):
+    return videoinfo_many([filename], osdb).get(filename, [])
+
+
+def videoinfo_many(filenames, osdb=None, chunksize=200):
+    """ Identify several video files at once by their OSDB hashes, using one
+        CheckMovieHash2 call per chunksize files (200 is the server limit).
+        Hashes and results are cached, unless 'cache' option is disabled, so
+        unchanged files are neither read nor looked up again for a while.
+        Return a dict {filename: list of OSDB titles}, each title injected
+        with the video 'hash' and 'size'. Files that could not be hashed or
+        identified map to an empty list. If osdb is None, the configured
+        user's session() is used, logging in only on cache misses
+    """
+    cache = hashtools.get_cache()
+
+    result = {}
+    hashes = {}  # hash => list of files, as duplicates share the same hash
+    titles = {}  # hash => list of titles, for cached ones
+    entries = {}  # filename => cache entry, to store looked up titles
+    for filename, vhash in hashtools.videohash_many(filenames,
+                                                    cache=cache).iteritems():
+        result[filename] = []
+        if isinstance(vhash, Exception):
+            log.error(vhash)
+            continue
+        hashes.setdefault(vhash, []).append(filename)
+
+        if cache is not None and not hashtools.is_url(filename):
+            # A file gone or unreadable since hashed is just a cache miss
             try:
-                result = result[vhash]
-            except TypeError:
-                # OSDB returned a list instead of a dictionary, Lord knows why
-                log.warn("OSDB returned a list for hash '%s'", hash)
-                result = result[0]
+                entry = entries[filename] = cache.lookup(filename)
+            except OSError as e:
+                log.warn("Could not look up '%s' in cache: %s", filename, e)
+                continue
+            ttl = INFO_TTL if entry['info'] else INFO_TTL_EMPTY
+            if entry['checked'] and entry['checked'] > time.time() - ttl:
+                titles[vhash] = entry['info']
+
+    vhashes = sorted(_ for _ in hashes if _ not in titles)
+    if titles:
+        log.debug("%d cached OSDB hashes, %d to look up",
+                  len(titles), len(vhashes))
+
+    # Only log in if there is anything left to look up
+    if vhashes and osdb is None:
+        osdb = session(g.options['osdb_username'], g.options['osdb_password'])
+
+    for i in xrange(0, len(vhashes), chunksize):
+        chunk = vhashes[i:i+chunksize]
+        try:
+            info = osdb.CheckMovieHash2(chunk)
+        except OpenSubtitlesError as e:
+            log.error(e)
+            continue
+
+        if info and not isinstance(info, dict):
+            # OSDB returned a list instead of a dictionary, Lord knows why
+            if len(chunk) > 1:
+                log.warn("OSDB returned a list for %d hashes, ignoring",
+                         len(chunk))
+                continue
+            log.warn("OSDB returned a list for hash '%s'", chunk[0])
+            info = {chunk[0]: info[0]}
+
+        for vhash in chunk:
+            titles[vhash] = (info or {}).get(vhash) or []
+            for filename in hashes[vhash]:
+                if filename in entries:
+                    cache.store_info(entries[filename], titles[vhash])
+
+    for vhash, vtitles in titles.iteritems():
+        for filename in hashes[vhash]:
             # Inject video hash and byte size into result
-            for r in result:
-                r['hash'] = vhash
-                r['size'] = os.path.getsize(filename)
-    except OpenSubtitlesError as e:
-        log.error(e)
+            try:
+                size = hashtools.videosize(filename)
+            except EnvironmentError as e:
+                log.error(e)
+                continue
+            result[filename] = [dict(title, hash=vhash, size=size)
+                                for title in vtitles]
 
     return result
@@ -23,15 +23,22 @@ from __future__ import unicode_literals, absolute_import, division
 import os
 import re
 import shutil
+import urllib
+import urlparse
 import logging
+import threading
 
-from . import g, datatools as dt, filetools as ft, srtclean
+from . import g, datatools as dt, filetools as ft, normalize, srtclean
+from . import hashtools
 from .providers import opensubtitles, legendastv as ltv
 from .utils import notify, print_debug
+from .pipeline import KeyedLock, SingleFlight, SharedIterable
 
 log = logging.getLogger(__name__)
 
 _provider = None
+_provider_lock = threading.Lock()
+_file_locks = KeyedLock()  # serialize work on the same archive or srt file
 _re_season_episode = re.compile(r"[S]?(?P<season>\d\d?)[Ex](?P<episode>\d\d?)",
                                 re.IGNORECASE)
 
@@ -40,10 +47,10 @@ def guess_movie_info(text):
     text = text.strip()
 
     # If 2+ years found, pick the last one and pray for a sane naming scheme
-    year = re.findall(r"(?<!\d)(?:19|20)\d{2}(?!\d)", text)
+    year = normalize.find_years(text)
     year = year[-1] if year else ""
 
-    release = dt.clean_string(text)
+    release = normalize.clean_string(text)
 
     if year:
         title = release.split(year,1)[1 if release.startswith(year) else 0]
@@ -51,41 +58,76 @@ def guess_movie_info(text):
         title = release
 
     # Remove some common "tags"
-    tags = ['1080p','720p','480p','hdtv','h264','x264','h65','dts','aac','ac3',
-            'bluray','bdrip','brrip','dvd','dvdrip','xvid','mp4','itunes',
-            'web dl','blu ray']
-    for s in tags:
-        title = re.sub(s, "", title, 0, re.IGNORECASE)
-    title = re.sub(" +", " ", title).strip()
+    title = normalize.remove_tags(title)
 
     result = dict(year=year, title=title, release=release)
-    print_debug("Guessed title info: '%s' -> %s" % (text, result))
+    print_debug("Guessed title info: '%s' -> %s", text, result)
     return result
 
 
 def get_provider():
     """A convenience function to allow re-usage of a provider instance
-        with a single initialization
+        with a single initialization. Thread-safe
     """
     global _provider
 
     if _provider is not None:
         return _provider
 
-    notify("Logging in Legendas.TV", icon=g.globals['appicon'])
-    _provider = ltv.LegendasTV()
-    _provider.login(g.options['login'],
-                    g.options['password'])
+    with _provider_lock:
+        if _provider is not None:
+            return _provider
 
-    if not _provider.auth:
-        raise g.LegendasError("Login failed, check your config file!")
+        notify("Logging in Legendas.TV", icon=g.globals['appicon'])
+        provider = ltv.LegendasTV()
+        provider.login(g.options['login'],
+                       g.options['password'])
+
+        if not provider.auth:
+            raise g.LegendasError("Login failed, check your config file!")
+
+        _provider = provider
 
     return _provider
 
 
-def retrieve_subtitle_for_movie(usermovie, remote=False):
+def identify_videos(paths):
+    """ Look up several video files at once in OpenSubtitles.org by their
+        hashes, in as few requests as possible.
+        Return a dict {path: list of OSDB titles}, suitable for the osdb_titles
+        argument of retrieve_subtitle_for_movie()
+    """
+    if not paths:
+        return {}
+
+    # No session is given, so it only logs in if not all hashes are cached
+    return opensubtitles.videoinfo_many(paths)
+
+
+def retrieve_subtitle_for_movie(usermovie, remote=False, osdb_titles=None):  # @UnusedVariable
     """ Main function to find, download, extract and match a subtitle for a
-        selected file
+        selected file or HTTP URL. remote is ignored, files on remote mounts
+        and URLs are hashed as well, with ranged reads
+        osdb_titles is the list of OpenSubtitles.org titles for the file,
+        as returned by identify_videos(). If None, file is looked up by itself
+    """
+    if osdb_titles is None:
+        osdb_titles = identify_videos([usermovie]).get(usermovie, [])
+
+    movie = prepare_movie(usermovie, osdb_titles)
+    if movie is None:
+        return
+
+    subs = plan_searches([movie])[0]
+    if isinstance(subs, Exception):
+        raise subs
+    return retrieve_subtitle(movie, subs, osdb_titles)
+
+
+def prepare_movie(usermovie, osdb_titles):
+    """ Guess the info of a video file from its name and its OpenSubtitles.org
+        titles, as returned by identify_videos().
+        Return a movie dict, or None if filename is not valid
     """
     try:
         usermovie = unicode(usermovie, 'UTF-8')
@@ -93,11 +135,20 @@ def retrieve_subtitle_for_movie(usermovie, remote=False):
         notify("Non UTF-8 chars in filename, ignoring: %r", usermovie, error=True)
         return
 
-    usermovie = os.path.abspath(usermovie)
-    print_debug("Target: %s" % usermovie)
-    savedir = os.path.dirname(usermovie)
-    dirname = os.path.basename(savedir)
-    filename = os.path.splitext(os.path.basename(usermovie))[0]
+    if hashtools.is_url(usermovie):
+        # Videos served over HTTP are hashed as they are, and their subtitle
+        # is saved to the current directory
+        path = urlparse.urlsplit(usermovie.encode('utf-8')).path
+        path = urllib.unquote(path).decode('utf-8', 'replace')
+        savedir = os.getcwdu()
+        dirname = os.path.basename(os.path.dirname(path))
+        filename = os.path.splitext(os.path.basename(path))[0]
+    else:
+        usermovie = os.path.abspath(usermovie)
+        savedir = os.path.dirname(usermovie)
+        dirname = os.path.basename(savedir)
+        filename = os.path.splitext(os.path.basename(usermovie))[0]
+    print_debug("Target: %s", usermovie)
 
     # Which string we use first for searches? Dirname or Filename?
     # Use Filename unless Dirname is much longer (presumably more relevant info)
@@ -111,6 +162,7 @@ def retrieve_subtitle_for_movie(usermovie, remote=False):
     movie.update({'episode': '',
                   'season': '',
                   'type': '',
+                  'savedir': savedir,
                   'dirname': dirname,
                   'filename': filename})
 
@@ -124,154 +176,320 @@ def retrieve_subtitle_for_movie(usermovie, remote=False):
         movie['title']   = movie['title'][:data_obj.start()].strip()
 
     # Get more useful info from OpenSubtitles.org
-    # Only for local files, as the hashing used for video ID
-    #  requires a full file copy over remote mounts (FTP/SSH)
-    if not remote:
-        movie = update_movie_with_osdb(usermovie, movie)
-
-    def season_to_ord(season):
-        season = int(season)
-        if   season == 1: tag = "st"
-        elif season == 2: tag = "nd"
-        elif season == 3: tag = "rd"
-        else            : tag = "th"
-        return "%d%s" % (season, tag)
+    # Also for remote mounts (FTP/SSH), as the hashing used for video ID
+    #  only reads the first and last 64KiB of the file
+    movie = update_movie_with_osdb(usermovie, movie, osdb_titles)
 
     log.debug("Target data: %s", movie)
 
     # Perform Mapping
-    mapped = False
+    movie['mapped'] = False
     if movie['title'].lower() in g.mapping:
         log.debug("Using title mapping: %s = %s",
                   movie['title'],
                   g.mapping[movie['title'].lower()])
         movie['title'] = g.mapping[movie['title'].lower()]
-        mapped = True
+        movie['mapped'] = True
 
-    # Let's begin with a movie search
     if movie['type'] == 'episode':
         movie['release'] = dt.clean_string(filename)
+
+    return movie
+
+
+def plan_searches(movies):
+    """ Batch planner: search Legendas.TV for the titles and subtitles of
+        several movies, as prepared by prepare_movie(), running each distinct
+        search only once, as for all episodes of a season.
+        Movies found are updated with their title info.
+        Return a list with the subtitles source for each movie, suitable for
+        choose_subtitle(), or None if there is nothing to search for.
+        Movies that failed map to the exception raised, so one bad movie
+        does not fail the others.
+        Result pages are shared by all movies of a search, and loaded only
+        as needed by any of them. Searches are also memoized, so concurrent
+        and later batches reuse them
+    """
+    result = [None] * len(movies)
+    groups = {}
+    for i, movie in enumerate(movies):
+        try:
+            season = (int(movie['season']) if movie['type'] == 'episode'
+                      else None)
+        except ValueError as e:
+            result[i] = e
+            continue
+        key = (movie['title'], season, movie['mapped'])
+        groups.setdefault(key, []).append(i)
+
+    log.debug("%d distinct title searches for %d videos",
+              len(groups), len(movies))
+
+    for key, group in sorted(groups.iteritems(), key=lambda _: _[1][0]):
+        try:
+            best = _find_title(*key)
+        except Exception as e:
+            for i in group:
+                result[i] = e
+            continue
+
+        for i in group:
+            try:
+                result[i] = _plan_movie(movies[i], best)
+            except Exception as e:
+                result[i] = e
+
+    return result
+
+
+def _plan_movie(movie, best):
+    """ Return the subtitles source for a movie, given its best title """
+    if best is None:
+        return _subtitle_pages('text', movie['release'])
+
+    movie.update(best)
+    log.debug("Target updated data: %s", movie)
+
+    if movie['type'] == 'episode':
+        notify("Searching subs for '%s' - Episode %d",
+               best['title_br'],
+               int(movie['episode'] or '0'),
+               icon=get_provider().getThumbnail(best))
+        if not movie['episode']:
+            notify("No episode data to search!", error=True)
+            return
+    else:
+        notify("Searching subs for '%s'", best['title'],
+               icon=get_provider().getThumbnail(best))
+
+    return _subtitle_pages('id', best['id'])
+
+
+def find_title(title, season=None, mapped=False):
+    """ Search Legendas.TV for a movie title, or for a season of a series if
+        season, and choose the most similar one.
+        If mapped, title is from user mapping, and an exact match is chosen.
+        Return the title dict, or None if none was similar enough
+    """
+    if season is not None:
         notify("Searching titles for: %s %s Season",
-               movie['title'],
-               season_to_ord(movie['season']),
+               title,
+               _season_to_ord(season),
                icon=g.globals['appicon'])
     else:
-        notify("Searching titles for '%s'", movie['title'],
+        notify("Searching titles for '%s'", title,
                icon=g.globals['appicon'])
 
+    movies = get_provider().getMovies(title)
+
+    if not movies:
+        # Ok, let's try by release...
+        notify("No titles found. Trying release...")
+        return
+
+    # Nice! Lets pick the best movie...
+    notify("%s titles found", len(movies))
+
+    # For Series, add Season to title and compare with native title
+    if season is not None:
+        search = 'title_br'
+        season = " %d" % season
+    else:
+        search = 'title'
+        season = ""
+
+    for m in movies:
+        # Add a helper field: cleaned-up title
+        m['search'] = dt.clean_string(m[search])
+        # For episodes, clean further
+        if season:
+            for tag in ['Temporada', 'temporada', 'Season', 'season', u'\xaa']:
+                m['search'] = m['search'].replace(tag, "")
+            m['search'] = m['search'].strip()
+        # For mapped titles, keep the match and discard others
+        if mapped and title == m[search]:
+            movies = [m]
+            log.debug("Enforcing title mapping, match found")
+            break
+
+    # May the Force be with... the most similar!
+    result = dt.choose_best_by_key(dt.clean_string(title) + season,
+                                   movies, 'search')
+
+    # But... Is it really similar?
+    if len(movies) == 1 or result['similarity'] >= g.options['similarity']:
+        return result['best']
+
+    # Almost giving up... forget movie matching
+    notify("None was similar enough. Trying release...")
+
+
+def _season_to_ord(season):
+    season = int(season)
+    if   season == 1: tag = "st"
+    elif season == 2: tag = "nd"
+    elif season == 3: tag = "rd"
+    else            : tag = "th"
+    return "%d%s" % (season, tag)
+
+
+def subtitle_pages(by, value):
+    """ Search Legendas.TV subtitles by movie 'id' or by 'text'.
+        Return a SharedIterable of result pages, each a list of subtitles
+    """
     legendastv = get_provider()
-    movies = legendastv.getMovies(movie['title'])
+    if by == 'id':
+        return SharedIterable(legendastv.iterSubtitlesByMovie({'id': value}))
+    return SharedIterable(legendastv.iterSubtitlesByText(value))
 
-    if len(movies) > 0:
-        # Nice! Lets pick the best movie...
-        notify("%s titles found", len(movies))
 
-        # For Series, add Season to title and compare with native title
-        if movie['type'] == 'episode':
-            season = " %d" % int(movie['season'])
-            search = 'title_br'
-        else:
-            season = ""
-            search = 'title'
-
-        for m in movies:
-            # Add a helper field: cleaned-up title
-            m['search'] = dt.clean_string(m[search])
-            # For episodes, clean further
-            if movie['type'] == 'episode':
-                for tag in ['Temporada', 'temporada', 'Season', 'season', u'\xaa']:
-                    m['search'] = m['search'].replace(tag, "")
-                m['search'] = m['search'].strip()
-            # For mapped titles, keep the match and discard others
-            if mapped and movie['title'] == m[search]:
-                movies = [m]
-                log.debug("Enforcing title mapping, match found")
-                break
-
-        # May the Force be with... the most similar!
-        title = dt.clean_string(movie['title'])
-        result = dt.choose_best_by_key(title + season, movies, 'search')
-
-        # But... Is it really similar?
-        if len(movies) == 1 or result['similarity'] >= g.options['similarity']:
-            movie.update(result['best'])
-            log.debug("Target updated data: %s", movie)
-
-            if movie['type'] == 'episode':
-                notify("Searching subs for '%s' - Episode %d",
-                       result['best']['title_br'],
-                       int(movie['episode'] or '0'),
-                       icon=os.path.join(g.globals['cache_dir'], 'thumbs',
-                                         os.path.basename(result['best']['thumb'] or "")))
-                if not movie['episode']:
-                    notify("No episode data to search!", error=True)
-                    return
-            else:
-                notify("Searching subs for '%s'", result['best']['title'],
-                       icon=os.path.join(g.globals['cache_dir'], 'thumbs',
-                                         os.path.basename(result['best']['thumb'] or "")))
-
-            subs = legendastv.getSubtitlesByMovie(movie)
+# Single-flight memos of searches, shared by all videos and threads
+_find_title = SingleFlight(find_title, maxsize=256)
+_subtitle_pages = SingleFlight(subtitle_pages, maxsize=64)
 
-        else:
-            # Almost giving up... forget movie matching
-            notify("None was similar enough. Trying release...")
-            subs = legendastv.getSubtitlesByText(movie['release'])
 
-    else:
-        # Ok, let's try by release...
-        notify("No titles found. Trying release...")
-        subs = legendastv.getSubtitlesByText(movie['release'])
+def retrieve_subtitle(movie, subs, osdb_titles=None):
+    """ Choose the best subtitle for a movie from subs, as planned by
+        plan_searches(), then download, extract, clean, and save it next to
+        the video, falling back to OpenSubtitles.org using osdb_titles.
+        Return True on success
+    """
+    return fetch_subtitles([(movie, find_subtitle(movie, subs, osdb_titles))])[0]
 
-    if not subs:
-        # Are you *sure* this movie exists? Try our interactive mode
-        # and search for yourself. I swear I tried...
-        notify("No subtitles found", error=True)
+
+def find_subtitle(movie, subs, osdb_titles=None):
+    """ Choose the best subtitle for a movie from subs, as planned by
+        plan_searches(), falling back to OpenSubtitles.org using osdb_titles.
+        Return a Legendas.TV subtitle dict, the filename of an srt downloaded
+        from OpenSubtitles.org, or None if none was found
+    """
+    if subs is None:
         return
 
     # Good! Lets choose and download the best subtitle...
-    notify("%s subtitles found", len(subs))
-
+    # Result pages are loaded only until a good enough one is found
     try:
-        subtitle = choose_subtitle(movie, subs)
+        return choose_subtitle(movie, subs)
     except g.LegendasError as e:
-        notify(e, error=True)
-        return
+        # Last resort: a subtitle matching the video hash in OpenSubtitles.org
+        srtfile = retrieve_osdb_subtitle(osdb_titles)
+        if not srtfile:
+            # Are you *sure* this movie exists? Try our interactive mode
+            # and search for yourself. I swear I tried...
+            notify(e, error=True)
+        return srtfile
+
+
+def fetch_subtitles(movies_subtitles):
+    """ Download, extract, clean and save next to each video the subtitles
+        chosen by find_subtitle(), given as a list of (movie, subtitle) pairs.
+        Each archive is downloaded and indexed only once, and its srt files
+        assigned to all movies using it in one pass, as for season packs.
+        Return a list with True for each movie whose subtitle was saved
+    """
+    result = [None] * len(movies_subtitles)
+    archives = {}
+    for i, (movie, subtitle) in enumerate(movies_subtitles):
+        if not subtitle:
+            continue
+        if isinstance(subtitle, dict):
+            archives.setdefault(subtitle['hash'], []).append(i)
+        else:
+            result[i] = save_subtitle(movie, subtitle)
+
+    for filehash, group in archives.iteritems():
+        movies = [movies_subtitles[i][0] for i in group]
+        subtitle = movies_subtitles[group[0]][1]
+        if len(group) > 1:
+            notify("Downloading '%s' from '%s', for %d videos",
+                   subtitle['release'],
+                   subtitle['user_name'],
+                   len(group))
+        else:
+            notify("Downloading '%s' from '%s'",
+                   subtitle['release'],
+                   subtitle['user_name'])
+
+        # Other videos may be using the same archive, as in season packs
+        with _file_locks(filehash):
+            archive = get_provider().downloadSubtitle(filehash,
+                                                      os.path.join(g.globals['cache_dir'],
+                                                                   'archives'),
+                                                      overwrite=False)
+            if not archive:
+                notify("ERROR downloading archive!", error=True)
+                continue
+
+            try:
+                srtfiles = _srt_index(archive).assign(movies)
+            except g.LegendasError as e:
+                notify(e, error=True)
+                continue
+
+        for i, movie, srtfile in zip(group, movies, srtfiles):
+            result[i] = save_subtitle(movie, srtfile)
+
+    return result
+
+
+def save_subtitle(movie, srtfile):
+    """ Clean an srt file and save a copy next to the movie video """
+    with _file_locks(srtfile):
+        srtclean.main(['--in-place', '--convert', 'UTF-8', srtfile])
+        srtbackup = "%s.srtclean.bak" % srtfile
+        # If srtclean modified the subtitle,
+        # rename the modified file and revert the backup
+        if os.path.isfile(srtbackup):
+            cleanfile = "%s.srtclean.srt" % os.path.splitext(srtfile)[0]
+            os.rename(srtfile, cleanfile)
+            os.rename(srtbackup, srtfile)
+            srtfile = cleanfile
+        shutil.copyfile(srtfile, os.path.join(movie['savedir'],
+                                              "%s.srt" % movie['filename']))
+    notify("DONE!")
+    return True
 
-    notify("Downloading '%s' from '%s'",
-           subtitle['release'],
-           subtitle['user_name'])
 
-    archive = legendastv.downloadSubtitle(subtitle['hash'],
-                                          os.path.join(g.globals['cache_dir'],
-                                                       'archives'),
-                                          overwrite=False)
-    if not archive:
-        notify("ERROR downloading archive!", error=True)
+def retrieve_osdb_subtitle(titles):
+    """ Search OpenSubtitles.org for subtitles matching the hash of a video,
+        given its OSDB titles, and download the most popular SRT one.
+        Return the subtitle filename, or None if none was found
+    """
+    if not titles:
         return
 
+    osdb = opensubtitles.session(g.options['osdb_username'],
+                                 g.options['osdb_password'])
+    lang = ','.join(opensubtitles.OpenSubtitles.languages.get(_, _)
+                    for _ in (g.options['language'] or "").split(','))
     try:
-        srtfile = choose_srt(movie, archive)
-    except g.LegendasError as e:
-        notify(e, error=True)
+        subs = osdb.SearchSubtitles([{
+            'sublanguageid': lang,
+            'moviehash':     titles[0]['hash'],
+            'moviebytesize': unicode(titles[0]['size']),
+        }]) or []
+    except opensubtitles.OpenSubtitlesError as e:
+        log.error(e)
         return
 
-    srtclean.main(['--in-place', '--convert', 'UTF-8', srtfile])
-    srtbackup = "%s.srtclean.bak" % srtfile
-    # If srtclean modified the subtitle,
-    # rename the modified file and revert the backup
-    if os.path.isfile(srtbackup):
-        cleanfile = "%s.srtclean.srt" % os.path.splitext(srtfile)[0]
-        os.rename(srtfile, cleanfile)
-        os.rename(srtbackup, srtfile)
-        srtfile = cleanfile
-    shutil.copyfile(srtfile, os.path.join(savedir, "%s.srt" % filename))
-    notify("DONE!")
-    return True
+    subs = [_ for _ in subs if _.get('SubFormat') == 'srt']
+    if not subs:
+        return
+
+    sub = max(subs, key=lambda _: int(_.get('SubDownloadsCnt') or 0))
+    notify("Downloading '%s' from OpenSubtitles.org", sub['SubFileName'])
+    try:
+        with _file_locks(sub['IDSubtitleFile']):
+            return opensubtitles.download_subtitles(
+                {sub['IDSubtitleFile']: ""},
+                os.path.join(g.globals['cache_dir'], 'osdb'),
+                osdb, overwrite=False).get(sub['IDSubtitleFile'])
+    except opensubtitles.OpenSubtitlesError as e:
+        log.error(e)
 
 
-def update_movie_with_osdb(path, movie):
-    osdb_movie = find_osdb_movie(path, movie)
+def update_movie_with_osdb(path, movie, titles=None):
+    osdb_movie = find_osdb_movie(path, movie, titles)
 
     if not osdb_movie:
         return movie
@@ -290,16 +508,16 @@ def update_movie_with_osdb(path, movie):
     return movie
 
 
-def find_osdb_movie(path, movie):
-    # Search OSDB by hash and get filtered list of results
-    osdb = opensubtitles.Osdb(g.options['osdb_username'],
-                              g.options['osdb_password'])
-    osdb_movies = [m for m in opensubtitles.videoinfo(path, osdb)
+def find_osdb_movie(path, movie, titles=None):
+    # Search OSDB by hash, unless already done, and get filtered list of results
+    if titles is None:
+        titles = opensubtitles.videoinfo(path)
+    osdb_movies = [m for m in titles
                    if m['MovieKind'] != 'tv series' and
                    (not movie['type'] or m['MovieKind']==movie['type'])]
 
-    print_debug("%d OpenSubtitles titles found:\n%s" %
-                (len(osdb_movies), dt.print_dictlist(osdb_movies)))
+    print_debug("%d OpenSubtitles titles found:\n%s",
+                len(osdb_movies), dt.lazy_dictlist(osdb_movies))
 
     if not osdb_movies:
         return
@@ -322,30 +540,41 @@ def find_osdb_movie(path, movie):
     return dt.choose_best_by_key(search, osdb_movies, 'search')['best']
 
 
-def choose_subtitle(movie, subs):
-    """Choose a subtitle from subs for a movie"""
+def choose_subtitle(movie, subs, threshold=None):
+    """ Choose a subtitle from subs for a movie.
+        subs is either a list of subtitles or an iterable of lists, one per
+        result page, as yielded by iterSubtitles(). In the latter, paging
+        stops as soon as the best candidate so far scores at least threshold,
+        by default the 'confidence' option. 0 disables it.
+    """
+    if threshold is None:
+        threshold = g.options['confidence']
+
+    if isinstance(subs, list):
+        subs = [subs]
 
     legendastv = get_provider()
 
-    # For TV Series, consider only packs and matching episodes
-    if movie['type'] == 'episode':
-        episodes = []
-        for sub in subs:
-            data_obj = re.search(_re_season_episode, sub['release'])
-            # Check whether the episode matches. The subtitle should never
-            # be selected if the episode doesn't match, even if it's a pack.
-            if data_obj:
-                data = data_obj.groupdict()
-                if (
-                    int(data['episode']) == int(movie['episode']) and
-                    int(data['season'])  == int(movie['season'])
-                ):
-                    episodes.append(sub)
-            elif sub['pack']:
-                episodes.append(sub)
-        subs = episodes
+    found = 0
+    candidates = []
+    subtitles = []
+    for page in subs:
+        found += len(page)
+        # Copies, as ranking updates them and pages may be shared
+        candidates.extend(dict(_) for _ in filter_episode(movie, page))
+        if not candidates:
+            continue
+
+        subtitles = legendastv.rankSubtitles(movie, candidates, top=1)
+        if threshold and subtitles[0]['score'] >= threshold:
+            log.debug("Confident match, stop paging: %s", subtitles[0])
+            break
+
+    if not found:
+        raise g.LegendasError("No subtitles found")
+
+    notify("%s subtitles found", found)
 
-    subtitles = legendastv.rankSubtitles(movie, subs)
     if not subtitles:
         raise g.LegendasError("No subtitles found for episode %d" %
                               int(movie['episode']))
@@ -353,53 +582,124 @@ def choose_subtitle(movie, subs):
     return subtitles[0]
 
 
+def filter_episode(movie, subs):
+    """ For TV Series, return only the packs and matching episodes in subs.
+        For movies, return subs unchanged
+    """
+    if movie['type'] != 'episode':
+        return subs
+
+    episodes = []
+    for sub in subs:
+        data_obj = re.search(_re_season_episode, sub['release'])
+        # Check whether the episode matches. The subtitle should never
+        # be selected if the episode doesn't match, even if it's a pack.
+        if data_obj:
+            data = data_obj.groupdict()
+            if (
+                int(data['episode']) == int(movie['episode']) and
+                int(data['season'])  == int(movie['season'])
+            ):
+                episodes.append(sub)
+        elif sub['pack']:
+            episodes.append(sub)
+    return episodes
+
+
 def choose_srt(movie, archive):
-    """Extract an archive and choose an srt file for a movie"""
+    """ Choose an srt file in an archive for a movie, and extract only it """
+    return _srt_index(archive).choose(movie)
+
 
-    files = ft.extract_archive(archive, extlist=["srt"])
-    if not files:
+def srt_index(archive):
+    """ List and index the srt files of an archive. See SrtIndex """
+    members = ft.list_archive(archive, extlist=["srt"])
+    if not members:
         raise g.LegendasError("ERROR! Archive is corrupt or has no subtitles")
 
-    if len(files) == 1:
-        return files[0]  # so much easier...
+    if len(members) > 1:
+        # Damn those multi-file archives!
+        notify("%s subtitles in archive", len(members))
 
-    # Damn those multi-file archives!
-    notify("%s subtitles in archive", len(files))
+    return SrtIndex(archive, members)
 
-    # Build a new list suitable for comparing
-    files = [dict(compare=dt.clean_string(os.path.basename(os.path.splitext(f)[0])),
-                  original=os.path.basename(f),
-                  full=f)
-             for f in files]
 
-    # If Series, match by Episode
-    srt = None
-    if movie['type'] == 'episode':
-        for item in files:
+# Archives already indexed, so the episodes sharing a pack walk it once
+_srt_index = SingleFlight(srt_index, maxsize=32)
+
+
+class SrtIndex(object):
+    """ The srt files of an archive, indexed by the season and episode
+        parsed from their names, so the files of a season pack are
+        assigned to all its episodes with a lookup for each.
+        Only the chosen files are extracted
+    """
+    def __init__(self, archive, members):
+        self.archive = archive
+
+        # Build a new list suitable for comparing
+        self.files = []
+        for member in members:
+            original = ft.member_basename(member)
+            self.files.append(dict(compare=dt.clean_string(os.path.splitext(original)[0]),
+                                   original=original,
+                                   member=member))
+
+        self.episodes = {}  # {episode: [files]}
+        self.seasons  = {}  # {(season, episode): [files]}
+        self.matchers = {}  # for dt.score_many(), shared by all movies
+        for item in self.files:
             data_obj = re.search(_re_season_episode, item['original'])
             if data_obj:
                 data = data_obj.groupdict()
-                if int(data['episode']) == int(movie['episode']):
-                    item['similarity'] = dt.get_similarity(movie['release'],
-                                                           item['compare'])
-                    if not srt or item['similarity'] > srt['similarity']:
-                        srt = item
-        if srt:
-            print_debug("Chosen for episode %s: %s" % (movie['episode'],
-                                                       srt['original']))
-    if not srt:
-        # Use name/release matching
-        # Should we use file or dir as a reference?
-        dirname_compare  = dt.clean_string(movie['dirname'])
-        filename_compare = dt.clean_string(movie['filename'])
-        if movie['type'] == 'episode' or \
-           dt.get_similarity(dirname_compare , files[0]['compare']) < \
-           dt.get_similarity(filename_compare, files[0]['compare']):
-            result = dt.choose_best_by_key(filename_compare,
-                                           files, 'compare')
-        else:
-            result = dt.choose_best_by_key(dirname_compare,
-                                           files, 'compare')
-        srt = result['best']
+                season, episode = int(data['season']), int(data['episode'])
+                self.episodes.setdefault(episode, []).append(item)
+                self.seasons.setdefault((season, episode), []).append(item)
+
+    def assign(self, movies):
+        """ Return a list with the srt file chosen for each movie """
+        return [self.choose(movie) for movie in movies]
 
-    return srt['full'] # convert back to string
+    def choose(self, movie):
+        """ Extract the srt file for a movie, return its filename """
+        if len(self.files) == 1:
+            return self.extract(self.files[0])  # so much easier...
+
+        # If Series, match by Episode, preferring the ones of its Season
+        srt = None
+        if movie['type'] == 'episode':
+            episode = int(movie['episode'])
+            episodes = (self.seasons.get((int(movie['season'] or 0), episode)) or
+                        self.episodes.get(episode))
+            if episodes:
+                result = dt.score_many(movie['release'],
+                                       [item['compare'] for item in episodes],
+                                       matchers=self.matchers)
+                srt = episodes[result['index']]
+                print_debug("Chosen for episode %s: %s", movie['episode'],
+                            srt['original'])
+        if not srt:
+            # Use name/release matching
+            # Should we use file or dir as a reference?
+            dirname_compare  = dt.clean_string(movie['dirname'])
+            filename_compare = dt.clean_string(movie['filename'])
+            compare = [item['compare'] for item in self.files]
+            result = dt.score_many(filename_compare, compare, best_only=True,
+                                   matchers=self.matchers)
+            if movie['type'] != 'episode':
+                dirresult = dt.score_many(dirname_compare, compare,
+                                          best_only=True,
+                                          matchers=self.matchers)
+                if dirresult['scores'][0] >= result['scores'][0]:
+                    result = dirresult
+            srt = self.files[result['index']]
+            print_debug("Chosen best subtitle file: %s (similarity %s)",
+                        srt['original'], result['similarity'])
+
+        return self.extract(srt)
+
+    def extract(self, item):
+        filename = ft.extract_member(self.archive, item['member'])
+        if not filename:
+            raise g.LegendasError("ERROR! Archive is corrupt or has no subtitles")
+        return filename
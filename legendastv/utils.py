@@ -22,11 +22,14 @@
 import os
 import dbus
 import logging
+import threading
 
 from . import g
 
 log = logging.getLogger(__name__)
 
+_notifier_lock = threading.Lock()
+
 
 def notify(body, *args, **kwargs):
     summary = kwargs.pop('summary', '')
@@ -44,11 +47,12 @@ def notify(body, *args, **kwargs):
         return
 
     # Use the same interface object in all calls
-    if not g.globals['notifier']:
-        _bus_name = 'org.freedesktop.Notifications'
-        _bus_path = '/org/freedesktop/Notifications'
-        _bus_obj  = dbus.SessionBus().get_object(_bus_name, _bus_path)
-        g.globals['notifier'] = dbus.Interface(_bus_obj, _bus_name)
+    with _notifier_lock:
+        if not g.globals['notifier']:
+            _bus_name = 'org.freedesktop.Notifications'
+            _bus_path = '/org/freedesktop/Notifications'
+            _bus_obj  = dbus.SessionBus().get_object(_bus_name, _bus_path)
+            g.globals['notifier'] = dbus.Interface(_bus_obj, _bus_name)
 
     app_name    = g.globals['apptitle']
     replaces_id = 0
@@ -66,5 +70,48 @@ def notify(body, *args, **kwargs):
     logger(logbody, *args)
 
 
-def print_debug(text):
+class Lazy(object):
+    """ Defer a function call until its result is formatted as a string, as
+        when passed as an argument to a logging call, so it costs nothing
+        if the message is never emitted. The result is computed only once
+    """
+    __slots__ = ('_func', '_args', '_kwargs', '_value')
+
+    def __init__(self, func, *args, **kwargs):
+        self._func   = func
+        self._args   = args
+        self._kwargs = kwargs
+
+    def value(self):
+        try:
+            return self._value
+        except AttributeError:
+            self._value = self._func(*self._args, **self._kwargs)
+            return self._value
+
+    def __str__(self):
+        value = self.value()
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
+
+    def __unicode__(self):
+        value = self.value()
+        if isinstance(value, str):
+            return value.decode('utf-8', 'replace')
+        return unicode(value)
+
+    def __repr__(self):
+        return repr(self.value())
+
+
+def print_debug(text, *args):
+    """ Log a debug message, possibly multi-line, indenting all but the
+        first line. If args are given, text is formatted with them, but only
+        if debug messages are enabled, so args can be Lazy objects
+    """
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    if args:
+        text = text % args
     log.debug('\n\t'.join(text.split('\n')))
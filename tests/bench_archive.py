@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# Benchmark choosing an episode subtitle from a synthetic season pack, with
+# nested archives, by extracting the whole archive as choose_srt() originally
+# did, against listing its members and extracting only the chosen one
+#
+# Usage: bench_archive.py [EPISODES [SIZE]]
+
+import os
+import sys
+import time
+import shutil
+import zipfile
+import tempfile
+from io import BytesIO
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import g, filetools as ft, subtitles
+
+
+def make_pack(filename, episodes, size):
+    srt = (b"1\n00:00:01,000 --> 00:00:02,000\nHello\n\n" * size)[:size]
+    nested = BytesIO()
+    with zipfile.ZipFile(nested, 'w', zipfile.ZIP_DEFLATED) as z:
+        for e in xrange(1, episodes + 1):
+            z.writestr('Show.S01E%02d.1080p.WEB-DL.srt' % e, srt)
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as z:
+        for e in xrange(1, episodes + 1):
+            z.writestr('720p/Show.S01E%02d.720p.HDTV.x264-LOL.srt' % e, srt)
+            z.writestr('480p/Show.S01E%02d.HDTV.XviD-AFG.srt' % e, srt)
+        z.writestr('Show.S01.1080p.zip', nested.getvalue())
+
+
+def du(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, files in os.walk(path) for name in files)
+
+
+def timeit(label, func, path):
+    start = time.time()
+    srt = func()
+    print "%-10s %.4fs, %7d bytes written, chose %s" % (
+        label, time.time() - start, du(path), os.path.basename(srt))
+    shutil.rmtree(path)
+
+
+def main(argv):
+    episodes = int(argv[0]) if len(argv) > 0 else 22
+    size     = int(argv[1]) if len(argv) > 1 else 60000
+
+    g.options['notifications'] = False
+    tmpdir = tempfile.mkdtemp()
+    archive = os.path.join(tmpdir, 'pack.zip')
+    path = os.path.splitext(archive)[0]
+    make_pack(archive, episodes, size)
+    movie = dict(type='episode', season='1', episode='5',
+                 release='Show S01E05 720p HDTV x264 LOL',
+                 dirname='Show', filename='Show.S01E05.720p.HDTV.x264-LOL')
+
+    print "%d episodes x 3 releases, %d bytes each" % (episodes, size)
+    try:
+        timeit("extract",
+               lambda: [f for f in ft.extract_archive(archive, extlist=["srt"])
+                        if "S01E05.720p" in f][0], path)
+        timeit("selective",
+               lambda: subtitles.srt_index(archive).choose(movie), path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
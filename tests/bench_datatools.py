@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Benchmark datatools.score_many() against the previous one-by-one
+# similarity scoring, and the n-gram pre-filtering of NgramIndex, on
+# synthetic release names
+#
+# Usage: bench_datatools.py [CANDIDATES...]
+
+import os
+import sys
+import time
+import random
+import difflib
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import datatools as dt
+
+from helpers import release
+
+
+def choose_best_string(reference, candidates):
+    """ The original implementation, for reference """
+    reference_lower  = reference.lower()
+    candidates_lower = [c.lower() for c in candidates]
+    result = difflib.get_close_matches(reference_lower, candidates_lower, 1, 0)[0]
+    index = candidates_lower.index(result)
+    return dict(best = candidates[index],
+                index = index,
+                similarity = dt.get_similarity(reference_lower, result, False))
+
+
+def timeit(label, func, *args):
+    start = time.time()
+    result = func(*args)
+    print "  %-28s %.3fs" % (label, time.time() - start)
+    return result
+
+
+def main(argv):
+    rnd = random.Random(42)
+    reference = "the big bang theory S05E12 720p hdtv x264 dimension"
+    for count in [int(_) for _ in argv] or [1000, 10000]:
+        candidates = [release(rnd) for _ in xrange(count)]
+        print "%d candidates" % count
+
+        expected = timeit("get_similarity, each", lambda: [
+            dt.get_similarity(reference, _) for _ in candidates])
+        result = timeit("score_many, all scores", dt.score_many,
+                        reference, candidates)
+        assert max(expected) == result['similarity']
+
+        # Same candidates against a second reference, as in season packs
+        matchers = {}
+        dt.score_many(reference, candidates, matchers=matchers)
+        other = "game of thrones S03E09 1080p webrip x264 killers"
+        expected = timeit("get_similarity, 2nd ref", lambda: [
+            dt.get_similarity(other, _) for _ in candidates])
+        result = timeit("score_many, 2nd ref, matchers", dt.score_many,
+                        other, candidates, True, 0.0, False, None, matchers)
+        assert expected == result['scores']
+
+        expected = timeit("choose_best_string, original", choose_best_string,
+                          reference, candidates)
+        result = timeit("choose_best_string", dt.choose_best_string,
+                        reference, candidates)
+        assert expected['similarity'] == result['similarity']
+
+        index = dt.NgramIndex()
+        texts = {}  # id => candidate
+        timeit("NgramIndex, build", lambda: [
+            texts.setdefault(index.add(_), _) for _ in candidates])
+        ids = timeit("NgramIndex, top 50", index.candidates, reference, 50)
+        found = dt.score_many(reference, [texts[_] for _ in ids],
+                              best_only=True)
+        print "  %-28s %.3f (exact %.3f)" % ("NgramIndex, best similarity",
+                                            found['similarity'],
+                                            expected['similarity'])
+        timeit("score_many, top 100", dt.score_many,
+               reference, candidates, True, 0.0, False, 100)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
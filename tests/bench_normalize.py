@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#
+# Microbenchmark the per-call cost of the original clean_string() and
+# release tag removal against the compiled and memoized ones in normalize,
+# on distinct strings (memo misses) and on repeated strings (memo hits)
+#
+# Usage: bench_normalize.py [CALLS]
+
+import os
+import sys
+import time
+import random
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import normalize
+
+from helpers import clean_string, remove_tags
+
+
+def percall(label, func, texts):
+    start = time.time()
+    for text in texts:
+        func(text)
+    usec = 10**6 * (time.time() - start) / len(texts)
+    print "%-32s %6.2fus" % (label, usec)
+
+
+def main(argv):
+    calls = int(argv[0]) if argv else 50000
+    rnd = random.Random(42)
+    words = ("[eztv] The.Big.Bang.Theory Game_of_Thrones (2011) S05E12"
+             " 720p HDTV x264-DIMENSION WEB-DL Blu-Ray").split()
+    distinct = [u" ".join(rnd.sample(words, 5)) + u" %d" % i
+                for i in xrange(calls)]
+    repeated = distinct[:50] * (calls // 50)
+
+    assert all(normalize.clean_string(_) == clean_string(_) for _ in distinct)
+    assert all(normalize.remove_tags(_) == remove_tags(_) for _ in distinct)
+    normalize.clean_string.clear()
+    normalize.remove_tags.clear()
+
+    print "%d calls" % calls
+    percall("clean_string, original", clean_string, distinct)
+    percall("clean_string, distinct strings", normalize.clean_string, distinct)
+    percall("clean_string, repeated strings", normalize.clean_string, repeated)
+    percall("remove_tags, original", remove_tags, distinct)
+    percall("remove_tags, distinct strings", normalize.remove_tags, distinct)
+    percall("remove_tags, repeated strings", normalize.remove_tags, repeated)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Benchmark serial versus parallel (prefetch) pagination of
+# LegendasTV.getSubtitles() against a local stand-in server, which serves
+# synthetic search result pages with a simulated network latency
+#
+# Usage: bench_pagination.py [PAGES [LATENCY_MS [PREFETCH]]]
+
+import os
+import sys
+import time
+import logging
+import threading
+import SocketServer
+import BaseHTTPServer
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import g
+from legendastv.providers import legendastv
+
+logging.basicConfig(level=logging.WARN)
+log = logging.getLogger(__name__)
+
+ROW = ('<div class="%(cls)s"><span class="number number_2">%(n)d</span>'
+       '<div class="f_left"><p><a href="/download/%(hash)032x/Gattaca/'
+       'gattaca_dvdrip_%(n)d">gattaca_dvdrip_divx61_ac3_%(n)d</a></p>'
+       '<p class="data">%(n)d downloads, nota 10, enviado por '
+       '<a href="/usuario/SuperEly">SuperEly</a> em 02/11/2006 - 16:13 </p>'
+       '</div><img src="/img/idioma/icon_brazil.png" alt="Portugu&#234;s-BR">'
+       '</div>')
+
+BASE = "/util/carrega_legendas_busca_filme/772/1"
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    pages = 10
+    latency = 0.1
+    rows = 25
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if self.path == BASE:
+            page = 1
+        elif self.path.startswith(BASE + "/-/"):
+            page = int(self.path.rpartition("/")[2])
+        else:
+            page = 0
+
+        if not 1 <= page <= self.pages:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        rows = "".join(ROW % dict(cls="", n=page * 100 + i, hash=page * 100 + i)
+                       for i in range(self.rows))
+        more = ('<a class="load_more" href="%s/-/%d">mais</a>' % (BASE, page + 1)
+                if page < self.pages else "")
+        body = "<html><body><article>%s</article>%s</body></html>" % (rows, more)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def run(prefetch, port):
+    class LocalTV(legendastv.LegendasTV):
+        url = "http://127.0.0.1:%d" % port
+
+    ltv = LocalTV()
+    start = time.time()
+    subs = ltv.getSubtitles(movie_id=772, prefetch=prefetch)
+    elapsed = time.time() - start
+
+    # let speculative requests past the last page finish, then hang up
+    time.sleep(2 * Handler.latency)
+    ltv.pool.close()
+    return elapsed, subs
+
+
+def main(argv):
+    Handler.pages   = int(argv[0]) if len(argv) > 0 else 10
+    Handler.latency = int(argv[1]) / 1000.0 if len(argv) > 1 else 0.1
+    prefetch        = int(argv[2]) if len(argv) > 2 else 4
+
+    g.options['cache'] = False
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    serial,   expected = run(1,        server.server_port)
+    parallel, subs     = run(prefetch, server.server_port)
+
+    assert [_['hash'] for _ in subs] == [_['hash'] for _ in expected]
+    print "%d pages, %d subtitles, %dms latency" % (Handler.pages, len(subs),
+                                                    Handler.latency * 1000)
+    print "serial:     %.3fs" % serial
+    print "prefetch %d: %.3fs (%.1fx)" % (prefetch, parallel, serial / parallel)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
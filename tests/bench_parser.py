@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Benchmark the original search results page parser of LegendasTV against
+# the compiled XPath one, on synthetic result page fixtures, after checking
+# both agree on the one in fixtures/
+#
+# Usage: bench_parser.py [ROWS [PAGES]]
+
+import os
+import sys
+import time
+from cStringIO import StringIO
+
+from lxml import html
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import g
+from legendastv.providers import legendastv
+
+from helpers import parse_subtitles
+
+
+ROW = ('<div class="%(cls)s"><span class="number number_2">%(n)d</span>'
+       '<div class="f_left"><p><a href="/download/%(hash)032x/Gattaca/'
+       'gattaca_dvdrip_%(n)d">%(pack)sgattaca_dvdrip_divx61_ac3_%(n)d</a></p>'
+       '<p class="data">%(n)d downloads, nota %(rating)s, enviado por '
+       '<a href="/usuario/SuperEly">SuperEly</a> em %(day)02d/11/2006 - 16:13 '
+       '</p></div><img src="/img/idioma/icon_%(flag)s.png" '
+       'alt="Portugu&#234;s-BR"></div>')
+
+BANNER = '<div class="banner_box"><script>ads();</script></div>'
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'fixtures', 'legendastv_results.html')
+
+
+def fixture(rows, page):
+    body = []
+    for i in range(rows):
+        n = page * 1000 + i
+        cls = ("destaque", "pack", "")[i % 3]
+        body.append(ROW % dict(cls=cls, n=n, hash=n, day=1 + i % 28,
+                               pack="(p)" if cls == "pack" else "",
+                               rating=(i % 11) or "",
+                               flag=("brazil", "usa")[i % 2]))
+        if i == rows // 2:
+            body.append(BANNER)
+    return ('<html><head><title>Legendas.TV</title></head><body><section>'
+            '<article>%s</article><a class="load_more" href="/util/'
+            'carrega_legendas_busca_filme/772/-/-/%d">mais</a></section>'
+            '</body></html>' % ("".join(body), page + 1))
+
+
+def timeit(label, func, trees):
+    start = time.time()
+    result = [func(_) for _ in trees]
+    print "%-10s %.3fs" % (label, time.time() - start)
+    return result
+
+
+def main(argv):
+    rows  = int(argv[0]) if len(argv) > 0 else 25
+    pages = int(argv[1]) if len(argv) > 1 else 400
+
+    g.options['cache'] = False
+    ltv = legendastv.LegendasTV()
+    languages = dict(brazil='pb', usa='en')
+    parser = html.HTMLParser(encoding='utf-8')
+
+    tree = html.parse(FIXTURE, parser=parser)
+    assert (ltv._parse_subtitles(tree, languages) ==
+            parse_subtitles(tree, languages))
+
+    print "%d pages of %d subtitles" % (pages, rows)
+    docs = [fixture(rows, page) for page in range(pages)]
+    trees = timeit("html.parse", lambda doc: html.parse(StringIO(doc),
+                                                        parser=parser), docs)
+
+    expected = timeit("original", lambda t: parse_subtitles(t, languages),
+                      trees)
+    result = timeit("compiled", lambda t: ltv._parse_subtitles(t, languages),
+                    trees)
+    assert result == expected
+    ltv.pool.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# Benchmark the original struct-based videohash() against the hashtools
+# engine, serial and threaded, on synthetic video files
+#
+# Usage: bench_videohash.py [FILES [SIZE_MB]]
+
+import os
+import sys
+import time
+import shutil
+import struct
+import tempfile
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import hashtools
+
+
+def videohash_struct(filename):
+    """ The original implementation, for reference """
+    block = 65536
+    fmt = b"<%dQ" % (block//8) # unsigned long long little endian
+    vhash = os.path.getsize(filename) # initial value for hash is file size
+
+    def partialhash(f):
+        return sum(struct.unpack(fmt, f.read(block)))
+
+    with open(filename, "rb") as f:
+        vhash += partialhash(f)
+        f.seek(-block, os.SEEK_END)
+        vhash += partialhash(f)
+        vhash &= 0xFFFFFFFFFFFFFFFF # to remain as 64bit number
+    return b"%016x" % vhash
+
+
+def timeit(label, func, *args):
+    start = time.time()
+    result = func(*args)
+    print "%-22s %.3fs" % (label, time.time() - start)
+    return result
+
+
+def main(argv):
+    count = int(argv[0]) if len(argv) > 0 else 200
+    size  = int(argv[1]) if len(argv) > 1 else 4
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        files = []
+        for i in range(count):
+            filename = os.path.join(tmpdir, "video%04d.mkv" % i)
+            with open(filename, 'wb') as f:
+                f.write(os.urandom(hashtools.BLOCK_SIZE))
+                f.seek(size * 2**20 - hashtools.BLOCK_SIZE)
+                f.write(os.urandom(hashtools.BLOCK_SIZE))
+            files.append(filename)
+
+        print "%d files, %dMB each, %s block sum" % (
+            count, size, 'numpy' if hasattr(hashtools, 'numpy') else 'array')
+
+        expected = timeit("struct, serial", lambda: dict(
+            (_, videohash_struct(_)) for _ in files))
+        serial = timeit("hashtools, serial", hashtools.videohash_many, files, 1)
+        threaded = timeit("hashtools, 4 threads", hashtools.videohash_many, files, 4)
+
+        assert expected == serial == threaded
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Benchmark xmlrpclib's default unmarshaller against the lxml-based one
+# used by the OpenSubtitles transport, on a synthetic SearchSubtitles
+# response fixture, after checking both agree on the one in fixtures/
+#
+# Usage: bench_xmlrpc.py [SUBTITLES [ROUNDS]]
+
+import os
+import sys
+import time
+import xmlrpclib
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv.providers import opensubtitles
+
+from helpers import parse
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'fixtures', 'osdb_search_subtitles.xml')
+
+# Fields of a typical SearchSubtitles result item
+FIELDS = ('MatchedBy IDSubMovieFile MovieHash MovieByteSize MovieTimeMS'
+          ' IDSubtitleFile SubFileName SubActualCD SubSize SubHash'
+          ' SubLastTS SubTSGroup IDSubtitle UserID SubLanguageID SubFormat'
+          ' SubSumCD SubAuthorComment SubAddDate SubBad SubRating'
+          ' SubDownloadsCnt MovieReleaseName MovieFPS IDMovie IDMovieImdb'
+          ' MovieName MovieNameEng MovieYear MovieImdbRating SubFeatured'
+          ' UserNickName ISO639 LanguageName SubComments SubHearingImpaired'
+          ' UserRank SeriesSeason SeriesEpisode MovieKind SubHD'
+          ' SeriesIMDBParent SubEncoding QueryNumber SubDownloadLink'
+          ' ZipDownloadLink SubtitlesLink').split()
+
+
+def fixture(count):
+    data = [dict((field, "%s value %d" % (field, i)) for field in FIELDS)
+            for i in range(count)]
+    for i, item in enumerate(data):
+        item['MovieName'] = u"Cidade de Deus \u00e7\u00e3o %d" % i
+        item['QueryParameters'] = {'moviehash': "%016x" % i,
+                                   'moviebytesize': str(i * 1024)}
+    return xmlrpclib.dumps(({'status': "200 OK", 'data': data,
+                             'seconds': 0.25},), methodresponse=True)
+
+
+def timeit(label, rounds, func, *args):
+    start = time.time()
+    for _ in xrange(rounds):
+        result = func(*args)
+    elapsed = (time.time() - start) / rounds
+    print "%-10s %.3fs" % (label, elapsed)
+    return elapsed, result
+
+
+def main(argv):
+    count  = int(argv[0]) if len(argv) > 0 else 2000
+    rounds = int(argv[1]) if len(argv) > 1 else 5
+
+    with open(FIXTURE, 'rb') as f:
+        data = f.read()
+    assert (parse(opensubtitles.OsdbTransport().getparser, data) ==
+            parse(xmlrpclib.getparser, data))
+
+    data = fixture(count)
+    print "%d subtitles, %.1fMB response" % (count, len(data) / 2.0**20)
+
+    default, expected = timeit("xmlrpclib", rounds, parse,
+                               xmlrpclib.getparser, data)
+    fast, result = timeit("lxml", rounds, parse,
+                          opensubtitles.OsdbTransport().getparser, data)
+
+    assert result == expected
+    print "speedup    %.1fx" % (default / fast)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Helpers shared by the tests and the benchmarks
+
+import re
+from datetime import datetime
+
+from legendastv import datatools as dt, normalize
+from legendastv.httptools import CHUNK_SIZE
+
+
+WORDS = ('the big bang theory game of thrones house breaking bad lost office'
+         ' cidade de deus gattaca matrix reloaded revolutions').split()
+TAGS  = ('720p 1080p hdtv webrip web-dl bluray dvdrip x264 xvid ac3 dts aac'
+         ' lol dimension killers fqm 2hd evolve proper repack').split()
+
+
+def release(rnd):
+    """ A synthetic release name, from random.Random rnd """
+    return "%s S%02dE%02d %s" % (" ".join(rnd.sample(WORDS, rnd.randint(1, 4))),
+                                 rnd.randint(1, 10), rnd.randint(1, 24),
+                                 " ".join(rnd.sample(TAGS, rnd.randint(2, 5))))
+
+def parse(getparser, data):
+    """ Parse an XML-RPC response with the (parser, unmarshaller) pair
+        from getparser, fed in CHUNK_SIZE chunks like a transport does
+    """
+    p, u = getparser()
+    for i in xrange(0, len(data), CHUNK_SIZE):
+        p.feed(data[i:i + CHUNK_SIZE])
+    p.close()
+    return u.close()
+
+
+def parse_subtitles(tree, languages):
+    """ The original LegendasTV results page parser, for reference """
+    subtitles = []
+    for e in tree.xpath(".//article/div"):
+        if e.attrib['class'].startswith('banner'): continue
+        data = e.xpath(".//text()")
+        dataurl = e.xpath(".//a")[0].attrib['href'].split('/')
+        dataline = data[2].split(' ')
+        sub = dict(
+            hash        = dataurl[2],
+            title       = dataurl[3],
+            downloads   = dataline[0],
+            rating      = dataline[3][:-1] or None,
+            date        = data[4].strip()[3:],
+            user_name   = data[3],
+            release     = data[1],
+            pack        = e.attrib['class'] == 'pack',
+            highlight   = e.attrib['class'] == 'destaque',
+            flag        = e.xpath("./img")[0].attrib['src']
+        )
+        dt.fields_to_int(sub, 'downloads', 'rating')
+        sub['language'] = languages.get(re.search(r"idioma/\w+_(\w+)\.",
+                                                  sub['flag']).group(1))
+        sub['date'] = datetime.strptime(sub['date'], '%d/%m/%Y - %H:%M')
+        if sub['release'].startswith("(p)") and sub['pack']:
+            sub['release'] = sub['release'][3:]
+        subtitles.append(sub)
+    return subtitles
+
+
+def clean_string(text):
+    """ The original datatools.clean_string(), for reference """
+    text = re.sub(r"^\[.+?]"   ,"",text)
+    text = re.sub(r"[][}{)(.,:_-]"," ",text)
+    text = re.sub(r" +"       ," ",text).strip()
+    return text
+
+
+def remove_tags(title):
+    """ The original tag removal in guess_movie_info(), for reference """
+    for s in normalize.TAGS:
+        title = re.sub(s, "", title, 0, re.IGNORECASE)
+    return re.sub(" +", " ", title).strip()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Tests for datatools similarity scoring
+#
+# Usage: test_datatools.py
+
+import os
+import sys
+import random
+import unittest
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import datatools as dt
+
+from helpers import release
+
+
+class ScoreManyTest(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(42)
+        self.reference = "The Big Bang Theory S05E12 720p HDTV x264 DIMENSION"
+        self.candidates = [release(rnd) for _ in xrange(500)]
+        self.candidates += self.candidates[:20]  # repeated ones
+
+    def test_scores_match_get_similarity(self):
+        result = dt.score_many(self.reference, self.candidates)
+        self.assertEqual(result['scores'],
+                         [dt.get_similarity(self.reference, _)
+                          for _ in self.candidates])
+
+    def test_best_matches_get_similarity(self):
+        expected = [dt.get_similarity(self.reference, _)
+                    for _ in self.candidates]
+        result = dt.score_many(self.reference, self.candidates,
+                               best_only=True)
+        self.assertEqual(result['similarity'], max(expected))
+        self.assertEqual(result['index'], expected.index(max(expected)))
+        self.assertEqual(result['best'], self.candidates[result['index']])
+
+    def test_orientation(self):
+        # ratio() is not symmetric: 0.48 one way, 0.32 the other
+        reference, candidate = "lol hdtv x264", "x264 lol dts"
+        self.assertNotEqual(dt.get_similarity(reference, candidate),
+                            dt.get_similarity(candidate, reference))
+        self.assertEqual(dt.score_many(reference, [candidate])['scores'],
+                         [dt.get_similarity(reference, candidate)])
+
+    def test_shared_matchers(self):
+        matchers = {}
+        for reference in (self.reference, "lost s01e01 720p hdtv lol",
+                          self.reference):
+            result = dt.score_many(reference, self.candidates,
+                                   matchers=matchers)
+            self.assertEqual(result['scores'],
+                             [dt.get_similarity(reference, _)
+                              for _ in self.candidates])
+        self.assertEqual(len(matchers),
+                         len(set(_.lower() for _ in self.candidates)))
+
+    def test_prefiltered_scores(self):
+        # Candidates left out by trigrams are not compared, and score 0.0
+        result = dt.score_many(self.reference, self.candidates, top=50)
+        compared = [i for i, score in enumerate(result['scores']) if score]
+        self.assertTrue(0 < len(set(self.candidates[_]
+                                    for _ in compared)) <= 50)
+        for i, score in enumerate(result['scores']):
+            if i in compared:
+                self.assertEqual(score, dt.get_similarity(
+                                            self.reference, self.candidates[i]))
+            else:
+                self.assertEqual(score, 0.0)
+        self.assertEqual(result['similarity'],
+                         max(result['scores'][_] for _ in compared))
+
+
+if __name__ == '__main__':
+    unittest.main()
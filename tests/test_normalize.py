@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#
+# Tests for normalize text functions against the original ones
+#
+# Usage: test_normalize.py
+
+import os
+import sys
+import unittest
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import normalize
+
+from helpers import clean_string, remove_tags
+
+
+class NormalizeTest(unittest.TestCase):
+
+    texts = [u"[eztv] The.Big.Bang.Theory.S05E12.720p.HDTV.x264-DIMENSION",
+             u"Game_of_Thrones (2011) WEB-DL Blu-Ray",
+             u"Gattaca 1997 DVDRip XviD AC3",
+             "Cidade de Deus (2002) BDRip H264 AAC"]
+
+    def test_clean_string(self):
+        for text in self.texts:
+            self.assertEqual(normalize.clean_string(text), clean_string(text))
+
+    def test_remove_tags(self):
+        for text in self.texts:
+            text = normalize.clean_string(text)
+            self.assertEqual(normalize.remove_tags(text), remove_tags(text))
+
+    def test_remove_overlapping_tags(self):
+        # Removing a tag may join the text around it into another tag, or
+        # a tag may contain another one, so removal order matters
+        for text in ("Matrix hd720ptv", "Matrix blubluraydvdrip",
+                     "Matrix DVDRIP dvd1080prip x2h264", "Matrix web dlx264"):
+            self.assertEqual(normalize.remove_tags(text), remove_tags(text))
+        self.assertEqual(normalize.remove_tags("Matrix hd720ptv"), "Matrix")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the search results page parser of LegendasTV
+#
+# Usage: test_parser.py
+
+import os
+import sys
+import unittest
+from datetime import datetime
+
+from lxml import html
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import g
+from legendastv.providers import legendastv
+
+from helpers import parse_subtitles
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'fixtures', 'legendastv_results.html')
+
+
+class ParseSubtitlesTest(unittest.TestCase):
+
+    languages = dict(brazil='pb', usa='en')
+
+    @classmethod
+    def setUpClass(cls):
+        g.options['cache'] = False
+        cls.ltv = legendastv.LegendasTV()
+        cls.tree = html.parse(FIXTURE,
+                              parser=html.HTMLParser(encoding='utf-8'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ltv.pool.close()
+
+    def test_rows(self):
+        # The banner is not a subtitle row
+        rows = self.ltv._rows(self.tree)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([_.get('class') for _ in rows],
+                         ["", "destaque", "pack", ""])
+
+    def test_same_as_original(self):
+        self.assertEqual(self.ltv._parse_subtitles(self.tree, self.languages),
+                         parse_subtitles(self.tree, self.languages))
+
+    def test_fields(self):
+        subs = self.ltv._parse_subtitles(self.tree, self.languages)
+        self.assertEqual(subs[0], dict(
+            hash      = "c0c4d6418a3474b2fb4e9dae3f797bd4",
+            title     = "Gattaca",
+            downloads = 1210,
+            rating    = 10,
+            date      = datetime(2006, 11, 2, 16, 13),
+            user_name = "SuperEly",
+            release   = "gattaca_dvdrip_divx61_ac3_(sailfish)",
+            pack      = False,
+            highlight = False,
+            flag      = "/img/idioma/icon_brazil.png",
+            language  = 'pb',
+        ))
+
+        self.assertTrue(subs[1]['highlight'])
+        self.assertEqual(subs[1]['user_name'], u"LegendasÁgil")
+
+        # Packs lose their "(p)" release prefix, and may not be rated
+        self.assertTrue(subs[2]['pack'])
+        self.assertEqual(subs[2]['release'],
+                         "Gattaca.1997.DVDRip.Pack.XviD-SAiNTS & outros")
+        self.assertEqual(subs[2]['rating'], None)
+        self.assertEqual(subs[2]['language'], 'en')
+
+        # Unknown flags have no language
+        self.assertEqual(subs[3]['language'], None)
+
+    def test_next_page(self):
+        self.assertEqual(self.ltv._xp_next(self.tree),
+                         ["/util/carrega_legendas_busca_filme/772/-/-/1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
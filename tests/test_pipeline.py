@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Tests for pipeline SingleFlight memoization and per-item batch errors
+#
+# Usage: test_pipeline.py
+
+import os
+import sys
+import unittest
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv import pipeline
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.fail = set()
+
+    def func(self, key):
+        self.calls.append(key)
+        if key in self.fail:
+            raise IOError("failed %s" % key)
+        return key * 2
+
+    def test_memoized(self):
+        flight = pipeline.SingleFlight(self.func, maxsize=8)
+        self.assertEqual(flight(1), 2)
+        self.assertEqual(flight(1), 2)
+        self.assertEqual(self.calls, [1])
+
+    def test_error_not_memoized(self):
+        flight = pipeline.SingleFlight(self.func, maxsize=8)
+        self.fail.add(1)
+        self.assertRaises(IOError, flight, 1)
+        self.fail.clear()
+        self.assertEqual(flight(1), 2)
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_error_not_memoized_after_rotation(self):
+        # With maxsize 4, a 3rd key rotates the first 2 to the old
+        # generation. A call failing there must not stay memoized either
+        flight = pipeline.SingleFlight(self.func, maxsize=4)
+        flight(0)
+        self.fail.add(1)
+        orig = self.func
+
+        def rotating(key):
+            if key == 1:
+                flight(2)  # rotates keys 0 and 1 to the old generation
+            return orig(key)
+
+        flight.func = rotating
+        self.assertRaises(IOError, flight, 1)
+        self.assertTrue((1,) not in flight._current)
+        self.assertTrue((1,) not in flight._old)
+
+        self.fail.clear()
+        self.assertEqual(flight(1), 2)
+        self.assertEqual(self.calls.count(1), 2)
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_batch_item_error(self):
+        def double(values):
+            return [ValueError(_) if _ == 3 else _ * 2 for _ in values]
+
+        stages = [pipeline.Stage('double', double, batch=10)]
+        result = list(pipeline.Pipeline(stages).run(xrange(6)))
+        self.assertEqual([_[0] for _ in result], range(6))
+        self.assertEqual([_[1] for _ in result], [0, 2, 4, None, 8, 10])
+        errors = [_[2] for _ in result]
+        self.assertTrue(isinstance(errors[3], ValueError))
+        self.assertEqual(errors[:3] + errors[4:], [None] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
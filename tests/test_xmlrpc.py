@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the lxml-based XML-RPC unmarshaller used by the OpenSubtitles
+# transport, against xmlrpclib's own, on OpenSubtitles.org responses
+#
+# Usage: test_xmlrpc.py
+
+import os
+import sys
+import unittest
+import xmlrpclib
+
+
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from legendastv.providers import opensubtitles
+
+from helpers import parse
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+def getparser():
+    return opensubtitles.OsdbTransport().getparser()
+
+
+def feed(data, size):
+    """ Parse data fed in chunks of size bytes """
+    p, u = getparser()
+    for i in xrange(0, len(data), size):
+        p.feed(data[i:i + size])
+    p.close()
+    return u.close()
+
+
+class UnmarshallerTest(unittest.TestCase):
+
+    def test_search_subtitles(self):
+        data = fixture('osdb_search_subtitles.xml')
+        result = parse(getparser, data)
+        self.assertEqual(result, parse(xmlrpclib.getparser, data))
+
+        reply = result[0]
+        self.assertEqual(reply['status'], "200 OK")
+        self.assertEqual(reply['seconds'], 0.087)
+        self.assertEqual(len(reply['data']), 2)
+
+        sub = reply['data'][0]
+        self.assertEqual(sub['IDSubtitleFile'], "1951997434")
+        self.assertEqual(sub['MovieName'], "Gattaca")
+        self.assertEqual(sub['MovieNameEng'], "")
+        self.assertEqual(sub['Score'], 18.08)
+        self.assertEqual(sub['QueryParameters'],
+                         {'moviehash': "8e245d9679d31e12",
+                          'moviebytesize': 12909756})
+        self.assertEqual(sub['SubAuthorComment'],
+                         u"Sincronizada para a versão SAiNTS."
+                         u" Revisão: José & Cia <equipe>")
+
+    def test_small_chunks(self):
+        # Chunks split tags, entities and multi-byte characters
+        data = fixture('osdb_search_subtitles.xml')
+        self.assertEqual(feed(data, 7), parse(xmlrpclib.getparser, data))
+
+    def test_fault(self):
+        data = fixture('osdb_fault.xml')
+        try:
+            parse(xmlrpclib.getparser, data)
+        except xmlrpclib.Fault as e:
+            expected = e
+
+        with self.assertRaises(xmlrpclib.Fault) as context:
+            parse(getparser, data)
+        self.assertEqual(context.exception.faultCode, 3)
+        self.assertEqual(context.exception.faultCode, expected.faultCode)
+        self.assertEqual(context.exception.faultString, expected.faultString)
+
+    def test_fault_raised_on_every_close(self):
+        # Parser and unmarshaller are the same object, closed in turn
+        p, u = getparser()
+        p.feed(fixture('osdb_fault.xml'))
+        self.assertRaises(xmlrpclib.Fault, p.close)
+        self.assertRaises(xmlrpclib.Fault, u.close)
+
+
+if __name__ == '__main__':
+    unittest.main()